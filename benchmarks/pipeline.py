@@ -0,0 +1,231 @@
+"""
+Benchmarks of the processing pipeline on synthetic registries, without network access.
+
+    python -m benchmarks.pipeline --sizes 10k 100k --save-baseline
+    python -m benchmarks.pipeline --sizes 10k 100k
+
+Every size runs in its own process on a temporary cache (DE_CASE_CACHE_ROOT) seeded with a snapshot
+from `benchmarks.synthetic`. The wall time and the peak traced memory of every stage are compared to
+the baseline, and the exit status is 1 if any of them regressed by more than the tolerance.
+"""
+from pathlib import Path
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+DEFAULT_SIZES = ["10k", "100k", "500k", "2M"]
+
+VISUALISATIONS = [
+    "visualisations.intervetion_type_pie_chart",
+    "visualisations.enrollment_of_comp_trial_by_year",
+    "visualisations.geographic_distribution_of_comp_trials",
+    "visualisations.number_of_studies_per_year",
+    "visualisations.number_of_trials_by_comp_and_cond",
+    "visualisations.total_enrollment_per_year",
+    "visualisations.trials_by_competitor_and_phase",
+]
+
+# Below these differences a change is noise, whatever its ratio to the baseline
+MIN_CHANGE = {"seconds": 0.05, "peak_mb": 5.0}
+
+
+class Stage:
+    """A step of the pipeline to measure. `reset` puts it back in its cold state before each run."""
+
+    def __init__(self, name, run, reset=None):
+        self.name = name
+        self.run = run
+        self.reset = reset or (lambda: None)
+
+
+def parse_size(size):
+    """Returns the number of rows of a size such as "500k" or "2M"."""
+    multipliers = {"k": 1000, "M": 1000000}
+    if size[-1] in multipliers:
+        return int(float(size[:-1]) * multipliers[size[-1]])
+    return int(size)
+
+def measure(stage, repeat=1, memory=True):
+    """Returns the best wall time of `repeat` cold runs of a stage and, with `memory`, its peak traced memory."""
+    seconds = []
+    for _ in range(repeat):
+        stage.reset()
+        gc.collect()
+        start = time.perf_counter()
+        stage.run()
+        seconds.append(time.perf_counter() - start)
+
+    peak_mb = None
+    if memory:
+        # A separate run, tracing allocations slows the stage down
+        stage.reset()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            stage.run()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+    return {"seconds": min(seconds), "peak_mb": peak_mb}
+
+def pipeline_stages():
+    """Returns the stages in pipeline order. Imports the pipeline, so the cache root must be set first."""
+    from importlib import import_module
+    from benchmarks.synthetic import make_locations
+    from src.data_processing import cache, context, pipeline, utils
+
+    def node_stage(name, getter):
+        def reset():
+            pipeline.invalidate(name)
+            cache.artifact_path(name).unlink(missing_ok=True)
+        return Stage(name, getter, reset)
+
+    def write_geographic_data():
+        # The locations come from the API in the real pipeline, record synthetic ones as up to date
+        competitor_trials = utils.get_competitor_trials()
+        geo_df = make_locations(competitor_trials["NCT Number"]).merge(competitor_trials, on="NCT Number")
+        cache.write("geographic_data", geo_df)
+        manifest = pipeline.read_manifest()
+        pipeline.record(
+            "geographic_data",
+            {"competitor_trials": manifest["competitor_trials"]["hash"]},
+            pipeline.NODES["geographic_data"].params(),
+        )
+
+    def prepare_data(module_name):
+        module = import_module(module_name)
+        if module_name.endswith("geographic_distribution_of_comp_trials"):
+            write_geographic_data()
+        return Stage(f"{module_name.split('.')[-1]}.prepare_data", module.prepare_data, context.data_context.invalidate)
+
+    enrollment = import_module("visualisations.enrollment_of_comp_trial_by_year")
+
+    def expand_data():
+        bar_df, _ = enrollment.prepare_data()
+        return Stage("expand_data", lambda: enrollment.expand_data(bar_df))
+
+    yield node_stage("conditions", utils.get_conditions)
+    yield node_stage("condition_index", utils.get_condition_index)
+    yield node_stage("competitors", utils.get_competitors)
+    yield node_stage("competitor_trials", utils.get_competitor_trials)
+    yield Stage("compact_snapshot", utils.get_compact_snapshot)
+    yield Stage("competitor_trials_one_cond", utils.get_competitor_trials_one_cond)
+    yield expand_data()
+    for module_name in VISUALISATIONS:
+        yield prepare_data(module_name)
+
+def run_size(size, repeat=1, memory=True, seed=0):
+    """Seeds the cache with a synthetic snapshot of `size` rows and measures every stage."""
+    from benchmarks.synthetic import make_studies
+    from src.data_processing import cache, pipeline, utils
+
+    results = {}
+    start = time.perf_counter()
+    studies = make_studies(parse_size(size), seed=seed)
+    cache.write("last_five_years_data", studies)
+    pipeline.record("last_five_years_data", params=utils.snapshot_params())
+    del studies
+    results["generate"] = {"seconds": time.perf_counter() - start, "peak_mb": None}
+
+    for stage in pipeline_stages():
+        results[stage.name] = measure(stage, repeat=repeat, memory=memory)
+        print(f"{size:>6} {stage.name:<56} {results[stage.name]['seconds']:8.3f}s", file=sys.stderr)
+    return results
+
+def run_in_subprocess(size, repeat, memory, seed):
+    """Runs one size in a fresh process with its own temporary cache and returns its results."""
+    with tempfile.TemporaryDirectory() as root:
+        env = dict(os.environ, DE_CASE_CACHE_ROOT=str(Path(root, "api_extracts")))
+        command = [sys.executable, "-m", "benchmarks.pipeline", "--worker", size,
+                   "--repeat", str(repeat), "--seed", str(seed)]
+        if not memory:
+            command.append("--no-memory")
+        output = subprocess.run(command, cwd=REPO_ROOT, env=env, stdout=subprocess.PIPE, check=True, text=True)
+    return json.loads(output.stdout)
+
+def compare(results, baseline, tolerance):
+    """Returns (size, stage, metric, baseline value, value) for every metric above the baseline by more than `tolerance`."""
+    regressions = []
+    for size, stages in results.items():
+        for stage, metrics in stages.items():
+            reference = baseline.get(size, {}).get(stage)
+            if reference is None or stage == "generate":
+                continue
+            for metric, min_change in MIN_CHANGE.items():
+                value, expected = metrics.get(metric), reference.get(metric)
+                if value is None or expected is None:
+                    continue
+                if value > expected * (1 + tolerance) and value - expected > min_change:
+                    regressions.append((size, stage, metric, expected, value))
+    return regressions
+
+def change(value, expected):
+    if value is None or not expected:
+        return ""
+    return f"{(value - expected) / expected:+.0%}"
+
+def report(results, baseline):
+    print(f"{'size':>6} {'stage':<56} {'seconds':>9} {'change':>7} {'peak MB':>9} {'change':>7}")
+    for size, stages in results.items():
+        for stage, metrics in stages.items():
+            reference = baseline.get(size, {}).get(stage, {})
+            peak = "" if metrics["peak_mb"] is None else f"{metrics['peak_mb']:.1f}"
+            print(f"{size:>6} {stage:<56} {metrics['seconds']:9.3f} {change(metrics['seconds'], reference.get('seconds')):>7} "
+                  f"{peak:>9} {change(metrics['peak_mb'], reference.get('peak_mb')):>7}")
+
+def read_baseline(path):
+    if not Path(path).exists():
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+def write_baseline(path, results):
+    """Saves the results as the baseline of their sizes, keeping the baseline of other sizes."""
+    baseline = read_baseline(path)
+    baseline.setdefault("sizes", {}).update(results)
+    baseline["environment"] = {"python": platform.python_version(), "machine": platform.machine(), "node": platform.node()}
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the processing pipeline on synthetic registries.")
+    parser.add_argument("--sizes", nargs="+", default=DEFAULT_SIZES, help="Registry sizes, e.g. 10k 2M.")
+    parser.add_argument("--repeat", type=int, default=1, help="Timed runs per stage, the best one is kept.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="Skip the peak memory runs.")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Save the results as the new baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed slowdown or memory growth, 0.25 is 25%%.")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(run_size(args.worker, repeat=args.repeat, memory=args.memory, seed=args.seed)))
+        return 0
+
+    results = {size: run_in_subprocess(size, args.repeat, args.memory, args.seed) for size in args.sizes}
+    baseline = read_baseline(args.baseline).get("sizes", {})
+    report(results, baseline)
+
+    if args.save_baseline:
+        write_baseline(args.baseline, results)
+        print(f"Saved the baseline to {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for size, stage, metric, expected, value in regressions:
+        print(f"REGRESSION {size} {stage} {metric}: {expected:.3f} -> {value:.3f}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
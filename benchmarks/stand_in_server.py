@@ -0,0 +1,353 @@
+"""
+Local stand-in for the ClinicalTrials.gov v2 API, serving a synthetic corpus.
+
+    python -m benchmarks.stand_in_server --studies 500k --port 8765 --latency 0.05 --throttle-rate 0.01
+    CLINICALTRIALS_BASE_URL=http://127.0.0.1:8765/api/v2/ python -m ...
+
+Serves /api/v2/version and /api/v2/studies in CSV and JSON, paginated with `nextPageToken` (JSON) or
+the `x-next-page-token` header (CSV), with `query.term` date ranges, `filter.ids`, `fields` and
+`countTotal`. Latency, bandwidth, server errors and 429s can be injected to exercise the client.
+/stats returns the number of requests, errors, 429s and bytes served so far.
+"""
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import numpy as np
+import pandas as pd
+from benchmarks.synthetic import COUNTRIES, make_studies
+from src.api_client.fields import get_field_registry
+
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 1000
+
+# AREA[...] of query.term -> corpus column it filters on
+AREAS = {
+    "StartDate": "Start Date",
+    "CompletionDate": "Completion Date",
+    "LastUpdatePostDate": "Last Update Posted",
+}
+RANGE_CLAUSE = re.compile(r"^AREA\[(\w+)\]RANGE\[\s*([\w-]+)\s*,\s*([\w-]+)\s*\]$")
+
+
+class BadRequest(Exception):
+    pass
+
+
+class Corpus:
+    """The synthetic studies served, with their dates parsed once for range queries."""
+
+    def __init__(self, n, seed=0):
+        self.studies = make_studies(n, seed=seed)
+        rng = np.random.default_rng(seed + 1)
+        start = self.dates("Start Date")
+        # Last updated some time between the start of the study and today
+        days_since = (np.datetime64(date.today()) - start).astype(int)
+        updated = start + (rng.random(len(start)) * np.maximum(days_since, 0)).astype(int)
+        self.studies["Last Update Posted"] = np.datetime_as_string(updated, unit="D").astype(object)
+        self._dates = {column: self.dates(column) for column in AREAS.values()}
+        self._positions = {nct_id: i for i, nct_id in enumerate(self.studies["NCT Number"])}
+        self._queries = {}
+        self._lock = threading.Lock()
+        self.data_timestamp = f"{date.today().isoformat()}T00:00:00"
+
+    def dates(self, column):
+        """Parses a date column, month precision dates standing for the first of the month."""
+        values = self.studies[column].fillna("").to_numpy(dtype=str)
+        values = np.where(np.char.str_len(values) == 7, np.char.add(values, "-01"), values)
+        return np.array(np.where(values == "", "NaT", values), dtype="datetime64[D]")
+
+    def select(self, term, ids):
+        """Returns the positions of the studies matching `query.term` and `filter.ids`, memoized."""
+        key = (term, ids)
+        with self._lock:
+            if key in self._queries:
+                return self._queries[key]
+
+        mask = np.ones(len(self.studies), dtype=bool)
+        for clause in filter(None, (clause.strip() for clause in term.split(" AND "))):
+            match = RANGE_CLAUSE.match(clause)
+            if match is None or match.group(1) not in AREAS:
+                raise BadRequest(f"Unsupported query.term clause {clause!r}, use AREA[{'|'.join(AREAS)}]RANGE[from, to]")
+            dates = self._dates[AREAS[match.group(1)]]
+            low, high = match.group(2), match.group(3)
+            if low != "MIN":
+                mask &= dates >= np.datetime64(low)
+            if high != "MAX":
+                mask &= dates <= np.datetime64(high)
+        positions = np.flatnonzero(mask)
+        if ids:
+            wanted = [self._positions[nct_id] for nct_id in ids.split(",") if nct_id in self._positions]
+            positions = np.intersect1d(positions, wanted)
+
+        with self._lock:
+            if len(self._queries) > 64:
+                self._queries.clear()
+            self._queries[key] = positions
+        return positions
+
+    def csv_page(self, positions, fields):
+        columns = fields or list(self.studies.columns)
+        unknown = set(columns) - set(self.studies.columns)
+        if unknown:
+            raise BadRequest(f"Unknown fields {sorted(unknown)}")
+        return self.studies.iloc[positions][columns].to_csv(index=False)
+
+    def json_studies(self, positions, fields):
+        if fields:
+            registry = get_field_registry()
+            columns = {column for column, data_fields in registry.columns.items() if set(data_fields) & set(fields)}
+        else:
+            columns = set(self.studies.columns) | {"Locations"}
+        return [study_json(row, columns) for row in self.studies.iloc[positions].to_dict("records")]
+
+
+def study_json(row, columns):
+    """Nests a corpus row like a v2 study, keeping only the modules of `columns`."""
+    def value(column):
+        return row[column] if column in columns and pd.notna(row[column]) else None
+
+    protocol = {}
+    if value("NCT Number") is not None:
+        protocol["identificationModule"] = {"nctId": value("NCT Number")}
+    status_module = {}
+    if value("Study Status") is not None:
+        status_module["overallStatus"] = value("Study Status")
+    for column, struct in [("Start Date", "startDateStruct"), ("Completion Date", "completionDateStruct"),
+                           ("Last Update Posted", "lastUpdatePostDateStruct")]:
+        if value(column) is not None:
+            status_module[struct] = {"date": value(column)}
+    if status_module:
+        protocol["statusModule"] = status_module
+    lead_sponsor = {}
+    if value("Sponsor") is not None:
+        lead_sponsor["name"] = value("Sponsor")
+    if value("Funder Type") is not None:
+        lead_sponsor["class"] = value("Funder Type")
+    if lead_sponsor:
+        protocol["sponsorCollaboratorsModule"] = {"leadSponsor": lead_sponsor}
+    if value("Conditions") is not None:
+        protocol["conditionsModule"] = {"conditions": value("Conditions").split("|")}
+    if value("Interventions") is not None:
+        protocol["armsInterventionsModule"] = {"interventions": [
+            dict(zip(("type", "name"), intervention.split(": ", 1))) for intervention in value("Interventions").split("|")
+        ]}
+    design = {}
+    if value("Phases") is not None:
+        design["phases"] = value("Phases").split("|")
+    if value("Enrollment") is not None:
+        design["enrollmentInfo"] = {"count": int(value("Enrollment"))}
+    if design:
+        protocol["designModule"] = design
+    if "Locations" in columns:
+        protocol["contactsLocationsModule"] = {"locations": [{"country": country} for country in countries(row["NCT Number"])]}
+    return {"protocolSection": protocol}
+
+def countries(nct_id):
+    """The countries of a study, the same on every request."""
+    rng = random.Random(nct_id)
+    return rng.sample(list(COUNTRIES), min(1 + int(rng.expovariate(0.4)), len(COUNTRIES)))
+
+def encode_token(query_key, offset):
+    return base64.urlsafe_b64encode(f"{query_key}:{offset}".encode()).decode().rstrip("=")
+
+def decode_token(token, query_key):
+    try:
+        key, offset = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode().rsplit(":", 1)
+        offset = int(offset)
+    except ValueError:
+        raise BadRequest("Malformed pageToken")
+    if key != query_key:
+        raise BadRequest("The pageToken belongs to another query")
+    return offset
+
+
+class Faults:
+    """Injected latency, bandwidth limit, server errors and rate limiting."""
+
+    def __init__(self, latency=0.0, jitter=0.0, bandwidth=None, error_rate=0.0, throttle_rate=0.0,
+                 max_rps=None, retry_after=1, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.max_rps = max_rps
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = max_rps or 0
+        self._refilled = time.monotonic()
+
+    def delay(self):
+        with self._lock:
+            jitter = self._random.uniform(0, self.jitter) if self.jitter else 0
+        if self.latency or jitter:
+            time.sleep(self.latency + jitter)
+
+    def fault(self):
+        """Returns the status code to fail the request with, or None."""
+        with self._lock:
+            if self.max_rps:
+                now = time.monotonic()
+                self._tokens = min(self.max_rps, self._tokens + (now - self._refilled) * self.max_rps)
+                self._refilled = now
+                if self._tokens < 1:
+                    return 429
+                self._tokens -= 1
+            draw = self._random.random()
+        if draw < self.throttle_rate:
+            return 429
+        if draw < self.throttle_rate + self.error_rate:
+            return 503
+        return None
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    corpus = None
+    faults = Faults()
+    stats = None
+    stats_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def count(self, **increments):
+        with self.stats_lock:
+            for name, value in increments.items():
+                self.stats[name] = self.stats.get(name, 0) + value
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        self.count(requests=1)
+        if url.path.rstrip("/") == "/stats":
+            with self.stats_lock:
+                stats = json.dumps(self.stats)
+            return self.respond(200, stats, "application/json")
+
+        self.faults.delay()
+        status = self.faults.fault()
+        if status is not None:
+            self.count(**{f"status_{status}": 1})
+            headers = {"Retry-After": str(self.faults.retry_after)} if status == 429 else {}
+            return self.respond(status, json.dumps({"message": "Injected failure"}), "application/json", headers)
+
+        try:
+            if url.path.rstrip("/") == "/api/v2/version":
+                body = json.dumps({"apiVersion": "2.0.3", "dataTimestamp": self.corpus.data_timestamp})
+                return self.respond(200, body, "application/json")
+            if url.path.rstrip("/") == "/api/v2/studies":
+                return self.studies(query)
+            return self.respond(404, json.dumps({"message": "Not found"}), "application/json")
+        except BadRequest as ex:
+            self.count(status_400=1)
+            return self.respond(400, json.dumps({"message": str(ex)}), "application/json")
+
+    def studies(self, query):
+        fmt = query.get("format", "json")
+        if fmt not in ("json", "csv"):
+            raise BadRequest("format has to be json or csv")
+        try:
+            page_size = min(int(query.get("pageSize", DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        except ValueError:
+            raise BadRequest("pageSize has to be an integer")
+        if page_size < 0:
+            raise BadRequest("pageSize has to be positive")
+        page_size = page_size or DEFAULT_PAGE_SIZE
+        fields = [field for field in re.split(r"[|,]", query.get("fields", "")) if field]
+        term, ids = query.get("query.term", ""), query.get("filter.ids", "")
+
+        positions = self.corpus.select(term, ids)
+        query_key = hashlib.sha1(json.dumps([fmt, term, ids, fields, page_size]).encode()).hexdigest()[:16]
+        offset = decode_token(query["pageToken"], query_key) if query.get("pageToken") else 0
+        page = positions[offset:offset + page_size]
+        next_token = encode_token(query_key, offset + page_size) if offset + page_size < len(positions) else None
+
+        if fmt == "csv":
+            headers = {"x-next-page-token": next_token} if next_token else {}
+            if query.get("countTotal") == "true":
+                headers["x-total-count"] = str(len(positions))
+            return self.respond(200, self.corpus.csv_page(page, fields), "text/csv", headers)
+
+        response = {"studies": self.corpus.json_studies(page, fields)}
+        if next_token:
+            response["nextPageToken"] = next_token
+        if query.get("countTotal") == "true":
+            response["totalCount"] = int(len(positions))
+        return self.respond(200, json.dumps(response), "application/json")
+
+    def respond(self, status, body, content_type, headers=None):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        if "gzip" in self.headers.get("Accept-Encoding", "") and len(body) > 1024:
+            body = gzip.compress(body, compresslevel=5)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.count(bytes=len(body))
+
+        if not self.faults.bandwidth:
+            self.wfile.write(body)
+            return
+        chunk = 16 * 1024
+        for start in range(0, len(body), chunk):
+            self.wfile.write(body[start:start + chunk])
+            time.sleep(min(chunk, len(body) - start) / self.faults.bandwidth)
+
+
+def make_server(corpus, faults=None, host="127.0.0.1", port=0):
+    """Returns an HTTP server serving `corpus`, not yet started. Port 0 picks a free port."""
+    handler = type("StandInHandler", (Handler,), {"corpus": corpus, "faults": faults or Faults(), "stats": {}})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+def start_server(corpus, faults=None, host="127.0.0.1", port=0):
+    """Serves `corpus` from a background thread and returns the server and the base URL of its API."""
+    server = make_server(corpus, faults, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{server.server_address[0]}:{server.server_address[1]}/api/v2/"
+
+def main(argv=None):
+    from benchmarks.pipeline import parse_size
+
+    parser = argparse.ArgumentParser(description="Serve a synthetic corpus through a stand-in of the ClinicalTrials.gov v2 API.")
+    parser.add_argument("--studies", default="100k", help="Size of the corpus, e.g. 10k or 2M.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many more seconds, at random.")
+    parser.add_argument("--bandwidth", type=float, default=None, help="Bytes per second of every response.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with 503.")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests failing with 429.")
+    parser.add_argument("--max-rps", type=float, default=None, help="Requests per second above which 429 is returned.")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After of the 429 responses, in seconds.")
+    args = parser.parse_args(argv)
+
+    corpus = Corpus(parse_size(args.studies), seed=args.seed)
+    faults = Faults(args.latency, args.jitter, args.bandwidth, args.error_rate, args.throttle_rate,
+                    args.max_rps, args.retry_after, seed=args.seed)
+    server = make_server(corpus, faults, args.host, args.port)
+    print(f"Serving {len(corpus.studies)} studies on http://{args.host}:{server.server_address[1]}/api/v2/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Deterministic synthetic study registries shaped like the five year snapshot"""
+from datetime import date, timedelta
+import json
+import numpy as np
+import pandas as pd
+
+SPONSOR = "Novo Nordisk A/S"
+
+FUNDER_TYPES = ["OTHER", "NIH", "OTHER_GOV", "NETWORK", "INDIV", "FED", "UNKNOWN"]
+
+PHASES = {
+    "NA": 0.25,
+    "": 0.14,
+    "PHASE1": 0.14,
+    "PHASE2": 0.15,
+    "PHASE3": 0.12,
+    "PHASE4": 0.08,
+    "PHASE1|PHASE2": 0.05,
+    "PHASE2|PHASE3": 0.04,
+    "EARLY_PHASE1": 0.03,
+}
+
+STATUSES = {
+    "COMPLETED": 0.38,
+    "RECRUITING": 0.22,
+    "ACTIVE_NOT_RECRUITING": 0.1,
+    "NOT_YET_RECRUITING": 0.08,
+    "UNKNOWN": 0.1,
+    "TERMINATED": 0.05,
+    "WITHDRAWN": 0.04,
+    "ENROLLING_BY_INVITATION": 0.03,
+}
+
+INTERVENTION_TYPES = {
+    "DRUG": 0.4,
+    "OTHER": 0.15,
+    "DEVICE": 0.1,
+    "BEHAVIORAL": 0.1,
+    "BIOLOGICAL": 0.08,
+    "PROCEDURE": 0.08,
+    "DIETARY_SUPPLEMENT": 0.05,
+    "DIAGNOSTIC_TEST": 0.04,
+}
+
+COUNTRIES = {
+    "United States": "USA", "China": "CHN", "France": "FRA", "Germany": "DEU", "United Kingdom": "GBR",
+    "Canada": "CAN", "Spain": "ESP", "Italy": "ITA", "Japan": "JPN", "Korea, Republic of": "KOR",
+    "Denmark": "DNK", "Netherlands": "NLD", "Poland": "POL", "Belgium": "BEL", "Australia": "AUS",
+    "Brazil": "BRA", "India": "IND", "Mexico": "MEX", "Turkey": "TUR", "Sweden": "SWE",
+    "Russian Federation": "RUS", "Argentina": "ARG", "Israel": "ISR", "Hungary": "HUN", "Czechia": "CZE",
+}
+
+
+def zipf_weights(n, exponent=1.1):
+    """Normalised weights of `n` ranks following a Zipf law, the first rank being the most likely."""
+    weights = 1 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+def choice(rng, values, n):
+    """Draws `n` values of a {value: probability} dict."""
+    keys = list(values)
+    probabilities = np.array([values[key] for key in keys])
+    return np.array(keys, dtype=object)[rng.choice(len(keys), size=n, p=probabilities / probabilities.sum())]
+
+def join_random(rng, vocabulary, weights, counts):
+    """Returns one "|"-joined string of `counts[i]` distinct draws from `vocabulary` per row."""
+    picks = rng.choice(len(vocabulary), size=(len(counts), counts.max()), p=weights)
+    joined = []
+    for row, count in zip(picks, counts):
+        joined.append("|".join(vocabulary[i] for i in dict.fromkeys(row[:count])))
+    return joined
+
+def condition_vocabulary(n_studies, condition_groups_path="cached_data/condition_groups.json"):
+    """
+    Returns the condition terms: the grouped conditions of `condition_groups_path` (the sponsor's
+    disease areas), a few excluded ones, then a long tail growing with the registry.
+    """
+    with open(condition_groups_path, "r") as file:
+        grouped = list(json.load(file))
+    tail = [f"Condition {i}" for i in range(max(500, n_studies // 40))]
+    return grouped, ["Healthy Volunteers", "Healthy Participants"] + tail
+
+def make_studies(n, seed=0, end=None):
+    """
+    Returns `n` synthetic studies with the columns the pipeline fetches for the five year snapshot.
+
+    The same `n` and `seed` always give the same frame. Sponsors and conditions follow Zipf laws so a
+    few of them are much more frequent than the rest, industry studies are often in the sponsor's
+    disease areas, phases are sometimes combined ("PHASE1|PHASE2") and durations have a long tail.
+    """
+    rng = np.random.default_rng(seed)
+    end = end or date.today()
+
+    n_sponsors = max(200, n // 25)
+    industry = max(40, n_sponsors // 4)
+    sponsors = np.array([SPONSOR] + [f"Pharma {i}" for i in range(industry)] +
+                        [f"University {i}" for i in range(n_sponsors - industry)], dtype=object)
+    sponsor_funders = np.array(["INDUSTRY"] * (industry + 1) +
+                               list(rng.choice(FUNDER_TYPES, size=n_sponsors - industry)), dtype=object)
+    # The sponsor runs a few tenths of a percent of the studies. The others are shuffled so industry
+    # sponsors are spread over the frequency ranks.
+    weights = np.concatenate([[0.003], 0.997 * zipf_weights(n_sponsors, 0.75)[np.argsort(rng.permutation(n_sponsors))]])
+    sponsor_codes = rng.choice(n_sponsors + 1, size=n, p=weights)
+
+    grouped, others = condition_vocabulary(n)
+    in_area_probability = np.where(sponsor_funders[sponsor_codes] == "INDUSTRY", 0.45, 0.15)
+    in_area_probability[sponsor_codes == 0] = 0.9
+    in_area = rng.random(n) < in_area_probability
+    counts = np.minimum(rng.geometric(0.45, size=n), 8)
+    area_conditions = join_random(rng, grouped, zipf_weights(len(grouped), 0.8), counts)
+    other_conditions = join_random(rng, others, zipf_weights(len(others)), counts)
+    conditions = np.where(in_area, area_conditions, other_conditions)
+
+    window = 5 * 365
+    start = np.array(end - timedelta(days=window), dtype="datetime64[D]") + rng.integers(0, window, size=n)
+    # Log-normal durations, a median of about two and a half years and some spanning decades
+    duration = np.minimum(rng.lognormal(np.log(900), 0.8, size=n), 30 * 365).astype(int)
+    completion = start + duration
+    start_dates = np.datetime_as_string(start, unit="D").astype(object)
+    completion_dates = np.datetime_as_string(completion, unit="D").astype(object)
+    # The registry also has month precision dates
+    month_precision = rng.random(n) < 0.2
+    start_dates[month_precision] = [value[:7] for value in start_dates[month_precision]]
+
+    # Completion dates and enrollments are always set, the visualisations cast them to int as is
+    enrollment = pd.array(np.maximum(1, rng.lognormal(np.log(120), 1.3, size=n)).astype(np.int64), dtype="Int64")
+
+    intervention_types = choice(rng, INTERVENTION_TYPES, n)
+    interventions = np.array([f"{kind}: Intervention {i}" for kind, i in
+                              zip(intervention_types, rng.integers(0, 5000, size=n))], dtype=object)
+    with_placebo = rng.random(n) < 0.25
+    interventions[with_placebo] = [value + "|OTHER: Placebo" for value in interventions[with_placebo]]
+    interventions[rng.random(n) < 0.08] = None
+
+    phases = choice(rng, PHASES, n)
+    phases[phases == ""] = None
+
+    return pd.DataFrame({
+        "NCT Number": [f"NCT{number:08d}" for number in rng.permutation(n * 3)[:n] + 1000000],
+        "Study Status": choice(rng, STATUSES, n),
+        "Conditions": conditions,
+        "Interventions": interventions,
+        "Sponsor": sponsors[sponsor_codes],
+        "Phases": phases,
+        "Enrollment": enrollment,
+        "Funder Type": sponsor_funders[sponsor_codes],
+        "Start Date": start_dates,
+        "Completion Date": completion_dates,
+    })
+
+def make_locations(nct_numbers, seed=0):
+    """Returns the countries of the given studies, one row per study and country."""
+    rng = np.random.default_rng(seed)
+    names = np.array(list(COUNTRIES), dtype=object)
+    counts = np.minimum(1 + rng.poisson(2.5, size=len(nct_numbers)), len(names))
+    rows = np.repeat(np.asarray(nct_numbers, dtype=object), counts)
+    countries = names[rng.choice(len(names), size=counts.sum(), p=zipf_weights(len(names), 0.7))]
+    locations = pd.DataFrame({"NCT Number": rows, "Country": countries}).drop_duplicates(ignore_index=True)
+    locations["Country Code"] = locations["Country"].map(COUNTRIES)
+    return locations
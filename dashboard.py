@@ -1,14 +1,50 @@
+import os
+
 import dash
-import dash_core_components as dcc
-import dash_html_components as html
+from dash import dcc, html
+from dash.dependencies import Input, Output
+from src import instrumentation
+
+CONDITION_GROUPS = 'cached_data/condition_groups.json'
+
+# Graph id -> module whose main() builds the figure and the artifacts (or files) it's built from.
+# The modules (and with them pandas and the data pipeline) are only imported when a figure is first
+# requested, so the server starts at once.
+FIGURES = {
+    'graph1': ('visualisations.intervetion_type_pie_chart', ['competitor_trials']),
+    'graph2': ('visualisations.enrollment_of_comp_trial_by_year', ['competitor_trials', 'conditions', CONDITION_GROUPS]),
+    'graph3': ('visualisations.geographic_distribution_of_comp_trials', ['geographic_data']),
+    'graph4': ('visualisations.number_of_studies_per_year', ['competitor_trials', 'conditions', CONDITION_GROUPS]),
+    'graph5': ('visualisations.number_of_trials_by_comp_and_cond', ['competitor_trials', 'conditions', CONDITION_GROUPS]),
+    'graph6': ('visualisations.total_enrollment_per_year', ['competitor_trials', 'conditions', CONDITION_GROUPS]),
+    'graph7': ('visualisations.trials_by_competitor_and_phase', ['competitor_trials']),
+}
+
+# Graphs with one set of traces per sponsor. Unless DE_CASE_SLICE_BY_SPONSOR is "0", only the traces
+# of the selected sponsor are sent, the others are fetched when picked in the dropdown above the graph.
+SPONSOR_GRAPHS = {'graph2', 'graph3', 'graph6'}
+SLICE_BY_SPONSOR = os.environ.get('DE_CASE_SLICE_BY_SPONSOR', '1') != '0'
+
 
-from visualisations.intervetion_type_pie_chart import main as intervention_type_pie_chart
-from visualisations.enrollment_of_comp_trial_by_year import main as enrollment_of_comp_trial_by_year
-from visualisations.geographic_distribution_of_comp_trials import main as geographic_distribution_of_comp_trials
-from visualisations.number_of_studies_per_year import main as number_of_studies_per_year
-from visualisations.number_of_trials_by_comp_and_cond import main as number_of_trials_by_comp_and_cond
-from visualisations.total_enrollment_per_year import main as total_enrollment_per_year
-from visualisations.trials_by_competitor_and_phase import main as trials_by_competitor_and_phase
+def placeholder(text="Loading..."):
+    """Returns an empty figure showing `text`, displayed until the real figure is built."""
+    return {
+        'data': [],
+        'layout': {
+            'xaxis': {'visible': False},
+            'yaxis': {'visible': False},
+            'annotations': [{'text': text, 'showarrow': False, 'font': {'size': 16}}],
+        },
+    }
+
+
+def graph(graph_id):
+    figure = dcc.Loading(dcc.Graph(id=graph_id, figure=placeholder()))
+    if SLICE_BY_SPONSOR and graph_id in SPONSOR_GRAPHS:
+        # The store holds the error of listing the sponsors, shown in the graph instead of the placeholder
+        return html.Div([dcc.Dropdown(id=f'{graph_id}-sponsor', clearable=False, placeholder='Sponsor'),
+                         dcc.Store(id=f'{graph_id}-sponsor-error'), figure])
+    return figure
 
 
 app = dash.Dash(__name__, external_stylesheets=['https://codepen.io/chriddyp/pen/bWLwgP.css'])
@@ -31,22 +67,83 @@ app.layout = html.Div([
                'fontFamily': '"Open Sans", verdana, arial, sans-serif'
            }),
     html.Div([
-        html.Div(dcc.Graph(id='graph1', figure=intervention_type_pie_chart()), className='six columns'),
-        html.Div(dcc.Graph(id='graph2', figure=enrollment_of_comp_trial_by_year()), className='six columns'),
+        html.Div(graph('graph1'), className='six columns'),
+        html.Div(graph('graph2'), className='six columns'),
     ], className='row'),
     html.Div([
-        html.Div(dcc.Graph(id='graph3', figure=geographic_distribution_of_comp_trials()), className='six columns'),
-        html.Div(dcc.Graph(id='graph4', figure=number_of_studies_per_year()), className='six columns'),
+        html.Div(graph('graph3'), className='six columns'),
+        html.Div(graph('graph4'), className='six columns'),
     ], className='row'),
     html.Div([
-        html.Div(dcc.Graph(id='graph5', figure=number_of_trials_by_comp_and_cond()), className='twelve columns'),
+        html.Div(graph('graph5'), className='twelve columns'),
     ], className='row'),
     html.Div([
-        html.Div(dcc.Graph(id='graph6', figure=total_enrollment_per_year()), className='twelve columns'),
+        html.Div(graph('graph6'), className='twelve columns'),
     ], className='row'),
-    html.Div(dcc.Graph(id='graph7', figure=trials_by_competitor_and_phase()), className='twelve columns'),
+    html.Div(graph('graph7'), className='twelve columns'),
+    dcc.Location(id='url'),
 ])
 
 
+def figure_callback(module_name, inputs):
+    def build_figure(pathname):
+        try:
+            # Served from the figure cache when the data hasn't changed since it was rendered
+            from src.data_processing.figures import get_figure
+
+            return get_figure(module_name, inputs)
+        except Exception as ex:
+            # Keep the rest of the dashboard usable, e.g. when the API is down and the cache is cold
+            return placeholder(f"Couldn't build this figure: {ex}")
+    return build_figure
+
+
+def sponsors_callback(module_name, inputs):
+    def list_sponsors(pathname):
+        try:
+            from src.data_processing.figures import get_sponsor_figure
+
+            sponsors = get_sponsor_figure(module_name, inputs, None)
+        except Exception as ex:
+            return [], None, f"Couldn't build this figure: {ex}"
+        if not sponsors:
+            return [], None, "No sponsors to show"
+        return sponsors, sponsors[0], None
+    return list_sponsors
+
+
+def sponsor_figure_callback(module_name, inputs):
+    def build_sponsor_figure(sponsor, error):
+        if error is not None:
+            return placeholder(error)
+        if sponsor is None:
+            return placeholder()
+        try:
+            from src.data_processing.figures import get_sponsor_figure
+
+            return get_sponsor_figure(module_name, inputs, sponsor)
+        except Exception as ex:
+            return placeholder(f"Couldn't build this figure: {ex}")
+    return build_sponsor_figure
+
+
+# Each figure is built by its own callback, fired on page load, so they render as they're ready
+for graph_id, (module_name, inputs) in FIGURES.items():
+    if SLICE_BY_SPONSOR and graph_id in SPONSOR_GRAPHS:
+        dropdown, error = f'{graph_id}-sponsor', f'{graph_id}-sponsor-error'
+        app.callback(Output(dropdown, 'options'), Output(dropdown, 'value'), Output(error, 'data'),
+                     Input('url', 'pathname'))(sponsors_callback(module_name, inputs))
+        app.callback(Output(graph_id, 'figure'),
+                     Input(dropdown, 'value'), Input(error, 'data'))(sponsor_figure_callback(module_name, inputs))
+    else:
+        app.callback(Output(graph_id, 'figure'), Input('url', 'pathname'))(figure_callback(module_name, inputs))
+
+
+@app.server.route('/metrics')
+def metrics():
+    """The span aggregates in the Prometheus text format, empty unless DE_CASE_INSTRUMENTATION is "1"."""
+    return instrumentation.prometheus_text(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
 if __name__ == '__main__':
     app.run_server(debug=True, port=8080)
\ No newline at end of file
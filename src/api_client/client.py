@@ -1,7 +1,14 @@
-from src.api_client.utils import json_handler, csv_handler
-from src.api_client import study_fields
-import csv
+from src.api_client.utils import json_handler, csv_handler, csv_columns_handler
+from src.api_client.fields import get_field_registry
+from src.api_client.spool import PullSpool
+from src import instrumentation
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+import os
+import queue
+import re
 import requests
+import threading
 
 
 class ClinicalTrials:
@@ -14,34 +21,50 @@ class ClinicalTrials:
     Attributes:
         study_fields: List of all study fields you can use in your query.
         api_info: Tuple containing the API version number and the last
-        time the database was updated.
+        time the database was updated. Fetched on first access, so creating
+        a client doesn't touch the network.
     """
 
     _BASE_URL = "https://clinicaltrials.gov/api/v2/"
     _JSON = "format=json"
     _CSV = "format=csv"
+    # Conservative limit on the length of a request URL, and room left for a page token
+    _MAX_URL_LENGTH = 4000
+    _PAGE_TOKEN_ALLOWANCE = 200
+    # Typed columns of the CSV export when decoded with fmt="frame"
+    _CSV_DTYPES = {"Enrollment": "Int64"}
+    # Statuses the API answers a page token it no longer accepts with
+    _REJECTED_TOKEN_STATUSES = (400, 404, 410)
+    _DATE_RANGE = re.compile(
+        r"AREA\[StartDate\]RANGE\[\s*(\d{4}-\d{2}-\d{2})\s*,\s*(\d{4}-\d{2}-\d{2})\s*\]"
+    )
 
-    def __init__(self):
-        self.api_info = self.__api_info()
+    def __init__(self, base_url=None):
+        """
+        Args:
+            base_url (str): Root of the API, e.g. a local stand-in server. Defaults to the
+                CLINICALTRIALS_BASE_URL environment variable, or to clinicaltrials.gov.
+        """
+        base_url = base_url or os.environ.get("CLINICALTRIALS_BASE_URL")
+        if base_url:
+            self._BASE_URL = base_url.rstrip("/") + "/"
+        self._api_info = None
+        self._api_info_lock = threading.Lock()
 
+    @property
+    def api_info(self):
+        """Tuple containing the API version number and the last time the database was updated."""
+        with self._api_info_lock:
+            if self._api_info is None:
+                self._api_info = self.__api_info()
+            return self._api_info
 
     @property
     def study_fields(self):
         """List of all study fields you can use in your query."""
+        registry = get_field_registry()
+        return {"csv": registry.csv_fields, "json": registry.json_fields}
 
-        csv_fields = []
-        json_fields = []
-        with open(study_fields, "r") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                csv_fields.append(row["Column Name"])
-                json_fields.append(row["Included Data Fields"].split("|"))
-
-        return {
-            "csv": csv_fields,
-            "json": [item for sublist in json_fields for item in sublist],
-        }
-    
     def __api_info(self):
         """Returns information about the API"""
         req, headers = json_handler(f"{self._BASE_URL}version")
@@ -51,90 +74,530 @@ class ClinicalTrials:
 
         return api_version, last_updated
     
-    def get_full_studies(self, search_expr, max_studies=50, fmt="csv"):
-            """Returns all content for a maximum of 100 study records.
-
-            Retrieves information from the full studies endpoint, which gets all study fields.
-            This endpoint can only output JSON (Or not-supported XML) format and does not allow
-            requests for more than 100 studies at once.
-
-            Args:
-                search_expr (str): A string containing a search expression as specified by
-                    `their documentation <https://clinicaltrials.gov/api/gui/ref/syntax#searchExpr>`_.
-                max_studies (int): An integer indicating the maximum number of studies to return.
-                    Defaults to 50.
-
-            Returns:
-                dict: Object containing the information queried with the search expression.
-
-            Raises:
-                ValueError: The number of studies can only be between 1 and 100
-            """
-            if fmt == "csv":
-                format = self._CSV
-                handler = csv_handler
-            elif fmt == "json":
-                format = self._JSON
-                handler = json_handler
-            else:
-                raise ValueError("Format argument has to be either 'csv' or 'json")
-        
-            if max_studies < 1:
-                raise ValueError("The number of studies can only be greater than 0")
-
-            all_studies = []
-            pageToken = None
-            while len(all_studies) < max_studies:
-                req = f"studies?{format}&markupFormat=legacy&query.term={search_expr}&pageSize={max_studies}"
-                if pageToken:
-                    req += f"&pageToken={pageToken}"
-                if fmt == "json":
-                    response, headers = json_handler(f"{self._BASE_URL}{req}")
-                    full_studies = response['studies']
-                    pageToken = response.get('nextPageToken', None)
-                else:  # fmt == "csv"
-                    full_studies, headers = csv_handler(f"{self._BASE_URL}{req}")
-                    pageToken = headers.get('x-next-page-token', None)
-                all_studies.extend(full_studies)
-                if not pageToken:
-                    break
-            return all_studies[:max_studies]
+    def get_full_studies(self, search_expr, max_studies=50, fmt="csv", workers=1, shards=None, spool_dir=None):
+        """Returns all content for a maximum of 100 study records.
+
+        Retrieves information from the full studies endpoint, which gets all study fields.
+        This endpoint can only output JSON (Or not-supported XML) format and does not allow
+        requests for more than 100 studies at once.
+
+        Args:
+            search_expr (str): A string containing a search expression as specified by
+                `their documentation <https://clinicaltrials.gov/api/gui/ref/syntax#searchExpr>`_.
+            max_studies (int): An integer indicating the maximum number of studies to return.
+                Defaults to 50.
+            workers (int): Number of concurrent page walkers. When greater than 1 and the
+                search expression contains an ``AREA[StartDate]RANGE[...]`` with explicit
+                dates, the range is split into non-overlapping date shards that are paged
+                in parallel. Defaults to 1 (a single sequential cursor).
+            shards (int): Number of date shards to split the range into. Defaults to
+                four shards per worker so that dense periods don't stall the pool.
+            fmt (str): "csv" for a list of rows (header first), "json" for a list of study
+                dicts, or "frame" for a pandas DataFrame decoded column by column from the CSV.
+            spool_dir (str): Directory where every fetched page and the token of the next one
+                are checkpointed. A pull that failed or was killed resumes from its last page
+                when it's called again with the same directory and arguments. The directory is
+                removed once the pull completes. Defaults to None (no checkpoints).
+
+        Returns:
+            dict: Object containing the information queried with the search expression.
+            A sharded pull returns the same studies as a sequential one. As the API's order
+            can't be rebuilt from the shards, they're sorted by NCT ID instead, while a
+            sequential pull keeps the API's order. When `max_studies` cuts the result short,
+            which studies are kept depends on that order, so the pull falls back to a single
+            cursor.
+
+        Raises:
+            ValueError: The number of studies can only be between 1 and 100
+        """
+        query = self.__full_studies_query(max_studies, fmt)
+        return self.__collect(search_expr, query, fmt, max_studies, workers, shards, spool_dir)
+
+    def iter_full_studies(self, search_expr, max_studies=50, fmt="csv", by="page", workers=1, shards=None, prefetch=True,
+                          spool_dir=None):
+        """Streams the results of `get_full_studies` instead of returning them at the end.
+
+        Concatenating everything this yields gives the list `get_full_studies` returns: for
+        CSV the first page (or record) is preceded by the header row, later pages are not.
+        With fmt="frame" every page is a DataFrame.
+        Only the page being consumed and, with `prefetch`, the next page are held in memory.
+
+        Args:
+            by (str): Either "page" to yield one list per page or "record" to yield the
+                records one by one.
+            workers (int): Number of date shards paged concurrently, see `get_full_studies`.
+                With more than one worker pages are yielded in arrival order.
+            prefetch (bool): Fetch the next page while the current one is being consumed.
+            spool_dir (str): Checkpoints the pull as in `get_full_studies`. A resumed pull
+                yields the spooled pages again first, the spool is removed once every page
+                has been consumed.
+        """
+        query = self.__full_studies_query(max_studies, fmt)
+        return self.__iter_collect(search_expr, query, fmt, max_studies, by, workers, shards, prefetch, spool_dir)
+
+    def get_study_fields(self, search_expr, fields, max_studies=50, fmt="csv", workers=1, shards=None, spool_dir=None):
+        """Returns the given fields of the studies matching a search expression.
+
+        Same as `get_full_studies`, but only `fields` are requested, so the download and
+        the parsing shrink with the fields left out. CSV and frame results select export
+        columns (e.g. "Sponsor"), JSON results data fields (e.g. "LeadSponsorName"), see
+        `study_fields`. `spool_dir` checkpoints the pull as in `get_full_studies`.
+        """
+        query = self.__study_fields_query(fields, max_studies, fmt)
+        return self.__collect(search_expr, query, fmt, max_studies, workers, shards, spool_dir)
+
+    def iter_study_fields(self, search_expr, fields, max_studies=50, fmt="csv", by="page", workers=1, shards=None, prefetch=True,
+                          spool_dir=None):
+        """Streams the results of `get_study_fields`, see `iter_full_studies`."""
+        query = self.__study_fields_query(fields, max_studies, fmt)
+        return self.__iter_collect(search_expr, query, fmt, max_studies, by, workers, shards, prefetch, spool_dir)
+
+    def get_studies_by_ids(self, nct_ids, fields=None, fmt="json", workers=4, max_url_length=None):
+        """Returns the studies with the given NCT IDs.
+
+        The IDs are sent as ``filter.ids`` in batches sized to keep every URL under
+        `max_url_length` characters, and the batches are fetched concurrently. The result
+        has the same shape as `get_full_studies`/`get_study_fields`.
+
+        Args:
+            nct_ids (list): NCT IDs of the studies to fetch. Repeated IDs are fetched once.
+            fields (list): Study fields to return, validated as in `get_study_fields`.
+                Defaults to all fields.
+            workers (int): Number of batches fetched concurrently. Defaults to 4.
+        """
+        if fields is None:
+            self.__full_studies_query(1, fmt)
+        else:
+            self.__study_fields_query(fields, 1, fmt)
+        if workers < 1:
+            raise ValueError("The number of workers can only be greater than 0")
+
+        format = self._JSON if fmt == "json" else self._CSV
+        field_param = f"&fields={'|'.join(fields)}" if fields else ""
 
+        def query(batch):
+            return f"studies?{format}&markupFormat=legacy&filter.ids={','.join(batch)}{field_param}&pageSize={len(batch)}"
 
-    def get_study_fields(self, search_expr, fields, max_studies=50, fmt="csv"):
+        batches = self.batch_ids(
+            list(dict.fromkeys(nct_ids)),
+            (max_url_length or self._MAX_URL_LENGTH) - len(self._BASE_URL) - len(query([])) - self._PAGE_TOKEN_ALLOWANCE,
+        )
+        if not batches:
+            return self.__merge([], fmt)
+        # A CSV result starts with its header row, which counts towards the limit
+        header_rows = 1 if fmt == "csv" else 0
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(lambda batch: self.__paginate(query(batch), fmt, len(batch) + header_rows), batches))
+
+        return self.__merge(results, fmt)
+
+    @staticmethod
+    def batch_ids(nct_ids, budget):
+        """Splits IDs into batches whose comma-joined length fits in `budget` characters."""
+        batches = []
+        batch, length = [], 0
+        for nct_id in nct_ids:
+            cost = len(nct_id) + (1 if batch else 0)
+            if batch and length + cost > budget:
+                batches.append(batch)
+                batch, length = [], 0
+                cost = len(nct_id)
+            batch.append(nct_id)
+            length += cost
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def __full_studies_query(self, max_studies, fmt):
+        """Validates the arguments of a full studies query and returns its URL builder."""
+        if fmt in ("csv", "frame"):
+            format = self._CSV
+        elif fmt == "json":
+            format = self._JSON
+        else:
+            raise ValueError("Format argument has to be either 'csv', 'json' or 'frame'")
+    
+        if max_studies < 1:
+            raise ValueError("The number of studies can only be greater than 0")
+
+        def query(expr):
+            return f"studies?{format}&markupFormat=legacy&query.term={expr}&pageSize={max_studies}"
+
+        return query
+
+    def __study_fields_query(self, fields, max_studies, fmt):
+        """Validates the arguments of a study fields query and returns its URL builder."""
         if fmt == "json":
             format = "format=json"
-            handler = json_handler
-        elif fmt == "csv":
+        elif fmt in ("csv", "frame"):
             format = "format=csv"
-            handler = csv_handler
         else:
-            raise ValueError("Format argument has to be either 'csv' or 'json")
+            raise ValueError("Format argument has to be either 'csv', 'json' or 'frame'")
 
-        if not set(fields).issubset(self.study_fields[fmt]):
+        if not get_field_registry().is_valid(fields, fmt):
             raise ValueError(
                 "One of the fields is not valid!"
                 "Check the study_fields attribute for a list of valid ones."
                 "They are different depending on the return format, json or csv."
             )
 
-        all_studies = []
-        pageToken = None
-        while len(all_studies) < max_studies:
-            concat_fields = "|".join(fields)
-            req = f"&query.term={search_expr}&markupFormat=legacy&fields={concat_fields}&pageSize={max_studies}"
-            if pageToken:
-                req += f"&pageToken={pageToken}"
-            url = f"{self._BASE_URL}studies?{format}{req}"
-            response, headers = handler(url)
+        concat_fields = "|".join(fields)
+
+        def query(expr):
+            return f"studies?{format}&query.term={expr}&markupFormat=legacy&fields={concat_fields}&pageSize={max_studies}"
+
+        return query
+
+    def __shards(self, search_expr, workers, shards):
+        """Returns the shard expressions to page concurrently, or [] for a single cursor."""
+        if workers < 1:
+            raise ValueError("The number of workers can only be greater than 0")
+        shard_exprs = self.shard_search_expr(search_expr, shards or workers * 4) if workers > 1 else []
+        return shard_exprs if len(shard_exprs) > 1 else []
+
+    def __collect(self, search_expr, query, fmt, max_studies, workers, shards, spool_dir=None):
+        """Runs a studies query either on a single cursor or sharded over a worker pool."""
+        shard_exprs = self.__shards(search_expr, workers, shards)
+        spool = self.__pull_spool(spool_dir, search_expr, query, fmt, shard_exprs)
+
+        def paginate(expr):
+            req = query(expr)
+            return self.__paginate(req, fmt, max_studies, spool.cursor(req) if spool else None)
+
+        with instrumentation.span("clinicaltrials.collect", fmt=fmt, shards=len(shard_exprs)) as span:
+            results = None
+            if shard_exprs:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    shard_results = list(pool.map(paginate, shard_exprs))
+                results = self.__merge(shard_results, fmt)
+                if len(results) > max_studies or any(len(result) >= max_studies for result in shard_results):
+                    # Truncated, the studies kept must be the first ones in the API's order
+                    span.add(fallback=1)
+                    results = None
+                else:
+                    results = self.__sorted(results, fmt)
+            if results is None:
+                results = paginate(search_expr)
+            span.add(rows_out=len(results))
+        if spool is not None:
+            spool.clear()
+        return results
+
+    def __pull_spool(self, spool_dir, search_expr, query, fmt, shard_exprs):
+        """Returns the `PullSpool` checkpointing a pull in `spool_dir`, or None without one."""
+        if spool_dir is None:
+            return None
+        return PullSpool(spool_dir, {
+            "base_url": self._BASE_URL,
+            "query": query(search_expr),
+            "fmt": fmt,
+            "shards": shard_exprs,
+        })
+
+    def __iter_collect(self, search_expr, query, fmt, max_studies, by, workers, shards, prefetch, spool_dir=None):
+        """Streaming counterpart of `__collect`."""
+        if by not in ("page", "record"):
+            raise ValueError("The by argument has to be either 'page' or 'record'")
+        if fmt == "frame" and by != "page":
+            raise ValueError("The 'frame' format can only be streamed by page")
+
+        shard_exprs = self.__shards(search_expr, workers, shards)
+        spool = self.__pull_spool(spool_dir, search_expr, query, fmt, shard_exprs)
+        if shard_exprs:
+            pages = self.__iter_sharded_pages(shard_exprs, query, fmt, max_studies, workers, prefetch, spool)
+        else:
+            req = query(search_expr)
+            pages = self.__iter_pages(req, fmt, max_studies, prefetch, spool.cursor(req) if spool else None)
+        if spool is not None:
+            pages = self.__clear_after(pages, spool)
+
+        if by == "page":
+            return pages
+        return (record for page in pages for record in page)
+
+    @staticmethod
+    def __clear_after(pages, spool):
+        """Yields `pages`, then removes the spool of the pull once they have all been consumed."""
+        yield from pages
+        spool.clear()
+
+    def __paginate(self, req, fmt, max_studies, spool=None):
+        """Follows the page tokens of a single query until it is exhausted, checkpointing them in `spool`."""
+        with instrumentation.span("clinicaltrials.paginate", fmt=fmt) as span:
+            if fmt == "frame":
+                pages = list(self.__iter_pages(req, fmt, max_studies, prefetch=False, spool=spool))
+                all_studies = self.__concat_frames(pages)
+                span.add(pages=len(pages))
+            else:
+                all_studies = []
+                for page in self.__iter_pages(req, fmt, max_studies, prefetch=False, spool=spool):
+                    all_studies.extend(page)
+                    span.add(pages=1)
+            span.add(rows_out=len(all_studies))
+            return all_studies
+
+    def __fetch_page(self, req, fmt, pageToken):
+        """Fetches one page and returns its records and the token of the next page."""
+        url = f"{self._BASE_URL}{req}"
+        if pageToken:
+            url += f"&pageToken={pageToken}"
+        with instrumentation.span("clinicaltrials.page", fmt=fmt) as span:
+            span.add(pages=1)
             if fmt == "json":
-                full_studies = response['studies']
-                pageToken = response.get('nextPageToken', None)
-            else:  # fmt == "csv"
-                full_studies = response
-                pageToken = headers.get('x-next-page-token')
-            all_studies.extend(full_studies)
-            if not pageToken:
-                break
-
-        return all_studies[:max_studies]
+                response, headers = json_handler(url)
+                return response['studies'], response.get('nextPageToken', None)
+            if fmt == "frame":
+                import pandas as pd
+
+                columns, headers = csv_columns_handler(url, dtypes=self._CSV_DTYPES)
+                return pd.DataFrame(columns, copy=False), headers.get('x-next-page-token', None)
+            # fmt == "csv"
+            full_studies, headers = csv_handler(url)
+            return full_studies, headers.get('x-next-page-token', None)
+
+    def __iter_pages(self, req, fmt, max_studies, prefetch=True, spool=None):
+        """Yields the pages of a single query, at most `max_studies` records in total.
+
+        With `prefetch` the request for the next page is issued before the current page
+        is handed out, so at most two pages are alive at any time.
+        """
+        count = 0
+        header = None
+        pages = self.__fetch_pages(req, fmt, prefetch, spool)
+        try:
+            for page in pages:
+                if fmt == "csv" and page:
+                    # Every CSV page is a standalone document, keep only the first header
+                    if header is None:
+                        header = page[0]
+                    elif page[0] == header:
+                        page = page[1:]
+                page = page[:max_studies - count]
+                count += len(page)
+                if len(page):
+                    yield page
+                if count >= max_studies:
+                    break
+        finally:
+            pages.close()
+
+    def __fetch_pages(self, req, fmt, prefetch=True, spool=None):
+        """Yields the pages of a single query as they're fetched, following the page tokens.
+
+        With a `spool` (a `PageSpool`) the pages it holds are yielded first, then the pull
+        resumes from its next page token and every new page is checkpointed in it. If the API
+        rejects that token, e.g. because it expired, the spool is dropped and the pull restarts.
+        """
+        pageToken = None
+        if spool is not None:
+            if spool.done:
+                yield from spool.pages()
+                return
+            pageToken = spool.next_token
+
+        pool = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            try:
+                page, nextPageToken = self.__fetch_page(req, fmt, pageToken)
+            except requests.HTTPError as ex:
+                if pageToken is None or ex.response is None or ex.response.status_code not in self._REJECTED_TOKEN_STATUSES:
+                    raise
+                spool.reset()
+                page, nextPageToken = self.__fetch_page(req, fmt, None)
+            if spool is not None:
+                # Only handed out once the pull is known to resume after them
+                yield from spool.pages()
+            pageToken = nextPageToken
+            while True:
+                upcoming = None
+                if pageToken and pool is not None:
+                    upcoming = pool.submit(self.__fetch_page, req, fmt, pageToken)
+                if spool is not None:
+                    spool.append(page, pageToken)
+                yield page
+
+                if not pageToken:
+                    break
+                if upcoming is not None:
+                    page, pageToken = upcoming.result()
+                else:
+                    page, pageToken = self.__fetch_page(req, fmt, pageToken)
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    def __iter_sharded_pages(self, shard_exprs, query, fmt, max_studies, workers, prefetch, spool=None):
+        """Pages shards on a worker pool and yields their pages as they arrive.
+
+        Pages travel through a queue bounded by the number of workers, so a slow consumer
+        stalls the workers instead of buffering the whole result. Repeated NCT IDs are
+        dropped and only one CSV header is emitted.
+        """
+        done = object()
+        pages = queue.Queue(maxsize=workers)
+        stop = threading.Event()
+        remaining = queue.SimpleQueue()
+        for expr in shard_exprs:
+            remaining.put(expr)
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def walk():
+            try:
+                while not stop.is_set():
+                    try:
+                        expr = remaining.get_nowait()
+                    except queue.Empty:
+                        break
+                    req = query(expr)
+                    for page in self.__iter_pages(req, fmt, max_studies, prefetch, spool.cursor(req) if spool else None):
+                        if not put(page):
+                            return
+            except Exception as ex:
+                put(ex)
+            finally:
+                put(done)
+
+        threads = [threading.Thread(target=walk, daemon=True) for _ in range(min(workers, len(shard_exprs)))]
+        for thread in threads:
+            thread.start()
+
+        try:
+            running = len(threads)
+            count = 0
+            header = None
+            seen = set()
+            while running:
+                page = pages.get()
+                if page is done:
+                    running -= 1
+                    continue
+                if isinstance(page, Exception):
+                    raise page
+
+                if fmt == "frame":
+                    page = self.__unseen_frame(page, seen)
+                else:
+                    prefix = []
+                    if fmt == "csv" and page:
+                        # Each shard starts with its own header, emit only the first one
+                        if header is None:
+                            header = page[0]
+                            prefix = [header]
+                        if page[0] == header:
+                            page = page[1:]
+                    page = prefix + self.__unseen(page, self.__id_key(fmt, header), seen)
+
+                page = page[:max_studies - count]
+                count += len(page)
+                if len(page):
+                    yield page
+                if count >= max_studies:
+                    break
+        finally:
+            stop.set()
+
+    @classmethod
+    def __merge(cls, results, fmt):
+        """Concatenates shard results in shard order, dropping repeated NCT IDs."""
+        if fmt == "frame":
+            return cls.__unseen_frame(cls.__concat_frames(results), set())
+        if fmt == "json":
+            header, rows = [], [study for shard in results for study in shard]
+        else:  # fmt == "csv"
+            shards = [shard for shard in results if shard]
+            if not shards:
+                return []
+            header = shards[0][:1]
+            rows = [row for shard in shards for row in shard[1:]]
+        return header + cls.__unseen(rows, cls.__id_key(fmt, header[0] if header else None), set())
+
+    @classmethod
+    def __sorted(cls, results, fmt):
+        """Returns results stably sorted by NCT ID, records without one last."""
+        if fmt == "frame":
+            if "NCT Number" not in results.columns:
+                return results
+            return results.sort_values("NCT Number", kind="stable", na_position="last", ignore_index=True)
+        if fmt == "json":
+            header, rows = [], results
+        else:  # fmt == "csv"
+            header, rows = results[:1], results[1:]
+        key = cls.__id_key(fmt, header[0] if header else None)
+        return header + sorted(rows, key=lambda row: (key(row) is None, key(row) or ""))
+
+    @staticmethod
+    def __id_key(fmt, header):
+        """Returns a function extracting the NCT ID of a record, or None if it has none."""
+        if fmt == "json":
+            return lambda study: study.get("protocolSection", {}).get("identificationModule", {}).get("nctId")
+        id_column = header.index("NCT Number") if header and "NCT Number" in header else None
+        return lambda row: row[id_column] if id_column is not None and len(row) > id_column else None
+
+    @staticmethod
+    def __unseen(rows, key, seen):
+        """Returns the rows whose NCT ID is not in `seen` and adds their IDs to it."""
+        unseen = []
+        for row in rows:
+            nct_id = key(row)
+            if nct_id is not None:
+                if nct_id in seen:
+                    continue
+                seen.add(nct_id)
+            unseen.append(row)
+        return unseen
+
+    @staticmethod
+    def __unseen_frame(frame, seen):
+        """Frame counterpart of `__unseen`."""
+        import numpy as np
+
+        if "NCT Number" not in frame.columns:
+            return frame
+        ids = frame["NCT Number"]
+        # Looked up one by one, isin() would copy the whole set for every page
+        known = np.fromiter((nct_id in seen for nct_id in ids), dtype=bool, count=len(ids))
+        keep = ~(known | ids.duplicated().to_numpy())
+        seen.update(ids[keep])
+        return frame[keep]
+
+    @staticmethod
+    def __concat_frames(frames):
+        import pandas as pd
+
+        frames = [frame for frame in frames if len(frame.columns)]
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+    @classmethod
+    def shard_search_expr(cls, search_expr, n):
+        """Splits the StartDate range of a search expression into ``n`` disjoint ranges.
+
+        Returns an empty list when the expression has no explicit StartDate range or
+        when sharding it would not be equivalent to the original query (e.g. ``OR``).
+        """
+        match = cls._DATE_RANGE.search(search_expr)
+        if match is None or " OR " in search_expr.upper():
+            return []
+
+        start = date.fromisoformat(match.group(1))
+        end = date.fromisoformat(match.group(2))
+        days = (end - start).days + 1
+        n = max(1, min(n, days))
+
+        exprs = []
+        for i in range(n):
+            shard_start = start + timedelta(days=days * i // n)
+            shard_end = start + timedelta(days=days * (i + 1) // n - 1)
+            shard_range = f"AREA[StartDate]RANGE[{shard_start.isoformat()}, {shard_end.isoformat()}]"
+            exprs.append(search_expr[:match.start()] + shard_range + search_expr[match.end():])
+        return exprs
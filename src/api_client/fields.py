@@ -0,0 +1,52 @@
+"""Registry of the study fields listed in fields.csv"""
+from functools import lru_cache
+import csv
+from src.api_client import study_fields
+
+
+class FieldRegistry:
+    """
+    The CSV columns of a study export and the data fields each of them is made of.
+
+    CSV requests select columns by their name (e.g. "Sponsor"), JSON requests by data field
+    (e.g. "LeadSponsorName"), so `data_fields` translates a set of columns for a JSON request.
+    """
+
+    def __init__(self, columns):
+        # Column name -> data fields, in the order of the export
+        self.columns = columns
+
+    @classmethod
+    def read(cls, path=study_fields):
+        columns = {}
+        with open(path, "r") as f:
+            for row in csv.DictReader(f):
+                columns[row["Column Name"]] = row["Included Data Fields"].split("|")
+        return cls(columns)
+
+    @property
+    def csv_fields(self):
+        return list(self.columns)
+
+    @property
+    def json_fields(self):
+        return [field for fields in self.columns.values() for field in fields]
+
+    def is_valid(self, fields, fmt):
+        """Returns whether all `fields` can be requested in format `fmt` ("csv", "frame" or "json")."""
+        return set(fields).issubset(self.json_fields if fmt == "json" else self.columns)
+
+    def ordered(self, columns):
+        """Returns the known `columns` in the order of the export, without repeats."""
+        columns = set(columns)
+        return [column for column in self.columns if column in columns]
+
+    def data_fields(self, columns):
+        """Returns the data fields making up `columns`, without repeats."""
+        return list(dict.fromkeys(field for column in columns for field in self.columns[column]))
+
+
+@lru_cache(maxsize=None)
+def get_field_registry():
+    """Returns the registry, fields.csv is only parsed on the first call."""
+    return FieldRegistry.read()
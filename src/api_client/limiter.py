@@ -0,0 +1,151 @@
+"""Client-wide rate and concurrency control of the requests to the API"""
+from contextlib import contextmanager
+import random
+import threading
+import time
+
+
+class AdaptiveLimiter:
+    """
+    Paces the requests of every thread sharing it with a token bucket and caps how many run at once.
+
+    Both limits adapt to the API: a throttled response (429) halves the rate and the concurrency and
+    pauses every request for its `Retry-After` (or an exponential backoff), while sustained success
+    raises them again, the concurrency by one request per `limit` successes and the rate by
+    `rate_step` per success, up to `max_concurrency` and `max_rate`. A limit is only raised while
+    requests are actually held back by it.
+    """
+
+    def __init__(self, rate=10.0, max_rate=50.0, rate_step=0.5, concurrency=8, max_concurrency=32,
+                 decrease=0.5, backoff_factor=1.0, max_backoff=60.0):
+        self.rate = float(rate)
+        self.min_rate = min(1.0, self.rate)
+        self.max_rate = float(max_rate)
+        self.rate_step = rate_step
+        self.limit = float(concurrency)
+        self.max_limit = float(max_concurrency)
+        self.decrease = decrease
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        # The bucket holds at least one token, or a rate below 1 would never let a request through
+        self._tokens = max(1.0, self.rate)
+        self._refilled = time.monotonic()
+        self._paused_until = 0.0
+        self._in_flight = 0
+        self._waiting = 0
+        self._successes = 0
+        self._throttles_in_row = 0
+        self._rate_bound = False
+        self._limit_bound = False
+        self.throttled_count = 0
+
+    @contextmanager
+    def slot(self):
+        """
+        Holds one of the `limit` concurrent request slots for the enclosed block, waiting for one to
+        free up if needed. Nested calls in the same thread share the slot of the outer one.
+        """
+        if getattr(self._local, "held", False):
+            yield
+            return
+        with self._cond:
+            self._waiting += 1
+            try:
+                while self._in_flight >= max(1, int(self.limit)):
+                    self._limit_bound = True
+                    self._cond.wait()
+            finally:
+                self._waiting -= 1
+            self._in_flight += 1
+        self._local.held = True
+        try:
+            yield
+        finally:
+            self._local.held = False
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+    def take(self):
+        """Waits until a request may be sent: any backoff is over and the bucket has a token."""
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    if now < self._paused_until:
+                        self._cond.wait(self._paused_until - now)
+                        continue
+                    self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._refilled) * self.rate)
+                    self._refilled = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    self._rate_bound = True
+                    self._cond.wait((1 - self._tokens) / self.rate)
+            finally:
+                self._waiting -= 1
+
+    def succeeded(self):
+        """Records a request the API accepted, ramping the limits up."""
+        with self._cond:
+            self._throttles_in_row = 0
+            if self._rate_bound:
+                self._rate_bound = False
+                self.rate = min(self.max_rate, self.rate + self.rate_step)
+            self._successes += 1
+            if self._successes >= self.limit:
+                self._successes = 0
+                if self._limit_bound:
+                    self._limit_bound = False
+                    self.limit = min(self.max_limit, self.limit + 1)
+                    self._cond.notify_all()
+
+    def throttled(self, retry_after=None):
+        """
+        Records a throttled request, backing the limits off and pausing every request for
+        `retry_after` seconds, or an exponential, jittered backoff if the API didn't say.
+        """
+        with self._cond:
+            self.throttled_count += 1
+            self._throttles_in_row += 1
+            self._successes = 0
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._tokens = min(self._tokens, max(1.0, self.rate))
+            self.limit = max(1.0, self.limit * self.decrease)
+            self._rate_bound = self._limit_bound = False
+            if retry_after is None:
+                retry_after = self.backoff_factor * 2 ** (self._throttles_in_row - 1) * (1 + random.random())
+            pause = min(self.max_backoff, retry_after)
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+            self._cond.notify_all()
+
+    def stats(self):
+        """Returns the current rate, concurrency limit, requests in flight and waiting, and throttled requests."""
+        with self._cond:
+            return {
+                "rate": self.rate,
+                "limit": max(1, int(self.limit)),
+                "in_flight": self._in_flight,
+                "queue_depth": self._waiting,
+                "throttled": self.throttled_count,
+            }
+
+
+def parse_retry_after(value):
+    """Returns the seconds to wait of a Retry-After header (seconds or an HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,240 @@
+"""Persistent cache of the API responses, reused until the registry is updated"""
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Size of the cache above which the least recently used responses are evicted, in bytes
+DEFAULT_MAX_BYTES = 2 * 2**30
+# Age after which a response is fetched again even if the registry wasn't updated, in seconds
+DEFAULT_TTL = 7 * 24 * 3600
+# Age after which the API version, and with it the registry's dataTimestamp, is fetched again
+DEFAULT_VERSION_TTL = 10 * 60
+
+
+def normalize_url(url):
+    """Returns `url` with a lowercase scheme and host and its query parameters sorted."""
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ""))
+
+def version_url(url):
+    """Returns the URL of the version endpoint of the API serving `url` (a v2 endpoint)."""
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path.rsplit("/", 1)[0] + "/version", "", ""))
+
+def is_version_url(url):
+    return urlsplit(url).path.rstrip("/").endswith("/version")
+
+
+class ResponseCache:
+    """
+    Successful API responses stored on disk, the bodies as received (compressed) next to a SQLite
+    index of their URL, headers, size, age and last access.
+
+    A response is reused while it is younger than `ttl` and the registry's `dataTimestamp` is the
+    one it was fetched at. The version endpoint giving the `dataTimestamp` is itself reused for
+    `version_ttl`, so the registry is checked for updates at most that often. Once the bodies take
+    more than `max_bytes`, the least recently used responses are evicted.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL, version_ttl=DEFAULT_VERSION_TTL):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.version_ttl = version_ttl
+        self.hits = 0
+        self.misses = 0
+
+        (self.directory / "bodies").mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.directory / "index.sqlite", timeout=30, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, url TEXT, status INTEGER, headers TEXT, size INTEGER, "
+                "data_timestamp TEXT, created REAL, accessed REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha256(normalize_url(url).encode()).hexdigest()
+
+    def get(self, url, data_timestamp=None):
+        """
+        Returns the cached (status, headers, body) of `url`, or None if it isn't cached, is older
+        than its TTL or was fetched at another `data_timestamp` than the given one.
+        """
+        key = self.key(url)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status, headers, data_timestamp, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        ttl = self.version_ttl if is_version_url(url) else self.ttl
+        if row is None or time.time() - row[3] > ttl or (data_timestamp is not None and row[2] != data_timestamp):
+            self.misses += 1
+            return None
+        try:
+            body = self.body_path(key).read_bytes()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        with self._lock, self._db:
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+        self.hits += 1
+        return row[0], json.loads(row[1]), body
+
+    def put(self, url, status, headers, body, data_timestamp=None):
+        """Stores a response, then evicts the least recently used ones if the cache is over `max_bytes`."""
+        writer = self.writer(url, status, headers, data_timestamp)
+        writer.write(body)
+        writer.commit()
+
+    def writer(self, url, status, headers, data_timestamp=None):
+        """Returns a `BodyWriter` storing a response whose body is written to it chunk by chunk."""
+        return BodyWriter(self, url, status, headers, data_timestamp)
+
+    def index(self, url, status, headers, size, data_timestamp=None):
+        """Records a response whose body has been stored, then evicts as in `put`."""
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.key(url), normalize_url(url), status, json.dumps(headers), size, data_timestamp, now, now),
+            )
+        self.evict()
+
+    def evict(self):
+        """Deletes the least recently used responses until the cache fits in `max_bytes`."""
+        with self._lock, self._db:
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            evicted = []
+            for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+                if total <= self.max_bytes:
+                    break
+                evicted.append(key)
+                total -= size
+            self._db.executemany("DELETE FROM responses WHERE key = ?", [(key,) for key in evicted])
+        for key in evicted:
+            self.body_path(key).unlink(missing_ok=True)
+
+    def clear(self):
+        with self._lock, self._db:
+            keys = [key for key, in self._db.execute("SELECT key FROM responses")]
+            self._db.execute("DELETE FROM responses")
+        for key in keys:
+            self.body_path(key).unlink(missing_ok=True)
+
+    def stats(self):
+        """Returns the number of cached responses, their size in bytes, and the hits and misses so far."""
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"entries": entries, "bytes": size, "hits": self.hits, "misses": self.misses}
+
+    def body_path(self, key):
+        return self.directory / "bodies" / key[:2] / key
+
+
+class BodyWriter:
+    """
+    Writes the body of a response into the cache as it's received. It's only indexed, and so
+    served, once `commit` is called; `abort` drops it.
+    """
+
+    def __init__(self, cache, url, status, headers, data_timestamp=None):
+        self.cache = cache
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.data_timestamp = data_timestamp
+        self.size = 0
+        self.path = cache.body_path(cache.key(url))
+        self.path.parent.mkdir(exist_ok=True)
+        self._partial_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.{threading.get_ident()}.partial")
+        self._file = open(self._partial_path, "wb")
+
+    def write(self, chunk):
+        self._file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self):
+        self._file.close()
+        os.replace(self._partial_path, self.path)
+        self.cache.index(self.url, self.status, self.headers, self.size, self.data_timestamp)
+
+    def abort(self):
+        self._file.close()
+        self._partial_path.unlink(missing_ok=True)
+
+
+class TeeStream(io.RawIOBase):
+    """
+    The raw body of a fetched response, as received, copied into a `BodyWriter` while it's read.
+    The body is cached once it's read to the end, and dropped if the stream is closed before.
+    """
+
+    def __init__(self, response, writer):
+        self._response = response
+        self._writer = writer
+        self._finished = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._response.raw.read(len(buffer))
+        if not data:
+            if not self._finished:
+                self._finished = True
+                self._writer.commit()
+            return 0
+        self._writer.write(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+    def read1(self, size=-1):
+        # Like a buffered stream's read1, which urllib3 uses to decode the body as it arrives
+        return self.read(size if size is not None and size >= 0 else io.DEFAULT_BUFFER_SIZE)
+
+    def close(self):
+        if not self.closed:
+            if not self._finished:
+                self._finished = True
+                self._writer.abort()
+            self._response.close()
+        super().close()
+
+
+def replay(url, status, headers, body):
+    """
+    Returns a streamable `requests.Response` serving a body as if it came from the network: a
+    cached body, or a `TeeStream` caching one as it's read.
+    """
+    import requests
+    from requests.structures import CaseInsensitiveDict
+    from requests.utils import get_encoding_from_headers
+    from urllib3 import HTTPResponse
+
+    headers = {name: value for name, value in headers.items() if name.lower() not in ("transfer-encoding", "content-length")}
+    if isinstance(body, bytes):
+        headers["Content-Length"] = str(len(body))
+        body = io.BytesIO(body)
+    response = requests.Response()
+    response.status_code = status
+    response.reason = "OK"
+    response.url = url
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = get_encoding_from_headers(response.headers)
+    response.raw = HTTPResponse(
+        body=body, headers=headers, status=status, preload_content=False, decode_content=False,
+        request_url=url,
+    )
+    return response
@@ -0,0 +1,104 @@
+"""Checkpoints of long paginated pulls, so an interrupted pull resumes where it stopped"""
+from pathlib import Path
+import hashlib
+import json
+import os
+import pickle
+import shutil
+
+
+class PullSpool:
+    """
+    Spool directory of one pull. Every cursor of the pull (a single one, or one per date shard) gets
+    its own `PageSpool` in a subdirectory.
+
+    The parameters of the pull are recorded on creation, reopening the directory with other
+    parameters raises a ValueError rather than mixing the pages of two different queries.
+    """
+
+    def __init__(self, directory, params):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        params = json.loads(json.dumps(params))
+        path = self.directory / "pull.json"
+        if path.exists():
+            recorded = read_json(path)
+            if recorded != params:
+                raise ValueError(
+                    f"The spool directory {self.directory} holds a pull with other parameters "
+                    f"({recorded}), remove it or use another one."
+                )
+        else:
+            write_json(params, path)
+
+    def cursor(self, req):
+        """Returns the spool of the cursor paging the query `req`."""
+        return PageSpool(self.directory / hashlib.sha256(req.encode()).hexdigest()[:16], req)
+
+    def clear(self):
+        """Deletes the spool, once the pull it checkpoints has completed."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class PageSpool:
+    """
+    The pages of one cursor fetched so far and the token of the next one. Each page is written
+    before the state pointing to it, both atomically, so a pull killed at any point resumes from
+    its last complete page.
+    """
+
+    def __init__(self, directory, req):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._state_path = self.directory / "state.json"
+        if self._state_path.exists():
+            self.state = read_json(self._state_path)
+            if self.state["req"] != req:
+                raise ValueError(f"The spool {self.directory} belongs to another query: {self.state['req']}")
+        else:
+            self.state = {"req": req, "pages": 0, "next_token": None, "done": False}
+
+    @property
+    def done(self):
+        return self.state["done"]
+
+    @property
+    def next_token(self):
+        return self.state["next_token"]
+
+    def pages(self):
+        """Yields the pages spooled so far, in order."""
+        for i in range(self.state["pages"]):
+            with open(self.__page_path(i), "rb") as f:
+                yield pickle.load(f)
+
+    def append(self, page, next_token):
+        """Records a fetched page and the token of the page after it (None after the last one)."""
+        path = self.__page_path(self.state["pages"])
+        partial_path = path.with_name(path.name + ".partial")
+        with open(partial_path, "wb") as f:
+            pickle.dump(page, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(partial_path, path)
+        self.state = {**self.state, "pages": self.state["pages"] + 1, "next_token": next_token, "done": not next_token}
+        write_json(self.state, self._state_path)
+
+    def reset(self):
+        """Drops the spooled pages, so the cursor is paged again from its first page."""
+        for i in range(self.state["pages"]):
+            self.__page_path(i).unlink(missing_ok=True)
+        self.state = {**self.state, "pages": 0, "next_token": None, "done": False}
+        write_json(self.state, self._state_path)
+
+    def __page_path(self, i):
+        return self.directory / f"page-{i:06d}.pkl"
+
+
+def read_json(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+def write_json(data, path):
+    partial_path = Path(f"{path}.partial")
+    with open(partial_path, "w") as f:
+        json.dump(data, f)
+    os.replace(partial_path, path)
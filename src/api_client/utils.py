@@ -1,15 +1,196 @@
 """Basic utilities module"""
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from array import array
 import csv
+import io
 import re
 import json
+import os
+import numpy as np
 import sys
+import threading
+from src import instrumentation
+from src.api_client.limiter import AdaptiveLimiter, parse_retry_after
+from src.api_client.response_cache import ResponseCache, TeeStream, is_version_url, replay, version_url
 
+# (connect, read) timeouts in seconds. Large CSV pages can take a while to stream.
+DEFAULT_TIMEOUT = (10, 120)
 
-def request_ct(url):
-    """Performs a get request that provides a (somewhat) useful error message."""
+_session = None
+_timeout = DEFAULT_TIMEOUT
+_session_lock = threading.RLock()
+
+# Statuses with which the API asks to slow down, handled by the shared limiter
+THROTTLE_STATUSES = (429,)
+
+_limiter = None
+_throttle_retries = 8
+
+_response_cache = None
+
+
+class TransportRetry(Retry):
+    """Retries without taking 429s, even with a Retry-After, which are left to the shared limiter."""
+
+    RETRY_AFTER_STATUS_CODES = frozenset(Retry.RETRY_AFTER_STATUS_CODES) - set(THROTTLE_STATUSES)
+
+
+def configure_transport(pool_size=16, timeout=DEFAULT_TIMEOUT, retries=5, backoff_factor=0.5, backoff_jitter=1.0):
+    """
+    Configures the pooled HTTP session shared by every handler.
+
+    The session keeps up to `pool_size` connections alive so pages reuse the same TCP/TLS
+    connection, negotiates gzip compression and retries 5xx responses with exponential,
+    jittered backoff (honouring `Retry-After`). 429s are left to the shared limiter.
+    """
+    global _session, _timeout
+
+    retry = TransportRetry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        backoff_jitter=backoff_jitter,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Accept-Encoding": "gzip, deflate"})
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = session
+        _timeout = timeout
+
+    return session
+
+def get_session():
+    """Returns the shared session, creating it with the default settings on first use."""
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                configure_transport()
+    return _session
+
+def configure_limiter(rate=10.0, max_rate=50.0, concurrency=8, max_concurrency=32, throttle_retries=8, **kwargs):
+    """
+    Configures the limiter every request goes through (see `AdaptiveLimiter`): requests start at
+    `rate` per second and `concurrency` at once, and adapt up to `max_rate` and `max_concurrency`.
+    A throttled request is retried up to `throttle_retries` times before its 429 is raised.
+    """
+    global _limiter, _throttle_retries
+
+    limiter = AdaptiveLimiter(rate=rate, max_rate=max_rate, concurrency=concurrency,
+                              max_concurrency=max_concurrency, **kwargs)
+    with _session_lock:
+        _limiter = limiter
+        _throttle_retries = throttle_retries
+    return limiter
+
+def get_limiter():
+    """Returns the shared limiter, creating it with the default settings on first use."""
+    if _limiter is None:
+        with _session_lock:
+            if _limiter is None:
+                configure_limiter()
+    return _limiter
+
+def limiter_stats():
+    return get_limiter().stats()
+
+instrumentation.gauge("de_case_api_rate", "Requests per second currently allowed by the limiter.", lambda: limiter_stats()["rate"])
+instrumentation.gauge("de_case_api_concurrency_limit", "Concurrent requests currently allowed by the limiter.", lambda: limiter_stats()["limit"])
+instrumentation.gauge("de_case_api_in_flight", "Requests holding a slot of the limiter.", lambda: limiter_stats()["in_flight"])
+instrumentation.gauge("de_case_api_queue_depth", "Requests waiting for the limiter.", lambda: limiter_stats()["queue_depth"])
+instrumentation.gauge("de_case_api_throttled_total", "Requests throttled by the API.", lambda: limiter_stats()["throttled"], kind="counter")
+
+def configure_response_cache(directory=None, **kwargs):
+    """
+    Caches the API responses on disk in `directory` (see `ResponseCache` for the other arguments),
+    or stops caching them when `directory` is None. Caching is off unless this is called or the
+    DE_CASE_HTTP_CACHE environment variable names a directory.
+    """
+    global _response_cache
+
+    with _session_lock:
+        _response_cache = ResponseCache(directory, **kwargs) if directory is not None else None
+    return _response_cache
+
+def get_response_cache():
+    return _response_cache
+
+def response_cache_stats():
+    return _response_cache.stats() if _response_cache is not None else {"entries": 0, "bytes": 0, "hits": 0, "misses": 0}
+
+instrumentation.gauge("de_case_http_cache_hits_total", "API responses served from the response cache.", lambda: response_cache_stats()["hits"], kind="counter")
+instrumentation.gauge("de_case_http_cache_misses_total", "API responses fetched because they weren't cached or were outdated.", lambda: response_cache_stats()["misses"], kind="counter")
+instrumentation.gauge("de_case_http_cache_bytes", "Size of the cached API responses.", lambda: response_cache_stats()["bytes"])
+
+def request_ct(url, stream=False):
+    """
+    Performs a get request that provides a (somewhat) useful error message. With `stream` the body
+    is left unread so it can be decoded incrementally from `response.raw`.
+
+    With the response cache on, a response cached since the registry's last update is served from
+    disk instead, and a fetched one is cached.
+    """
+    cache = _response_cache
+    if cache is None:
+        return fetch_ct(url, stream)
+
+    data_timestamp = None if is_version_url(url) else current_data_timestamp(url)
+    cached = cache.get(url, data_timestamp)
+    if cached is not None:
+        response = replay(url, *cached)
+    else:
+        fetched = fetch_ct(url, stream=True)
+        # The body is cached as it comes in while the replayed response decodes it like a fetched one,
+        # so it's never held in memory whole
+        fetched.raw.decode_content = False
+        status, headers = fetched.status_code, dict(fetched.headers)
+        body = TeeStream(fetched, cache.writer(url, status, headers, data_timestamp))
+        response = replay(url, status, headers, body)
+    if stream:
+        response.raw.decode_content = True
+    return response
+
+def current_data_timestamp(url):
+    """
+    Returns the `dataTimestamp` of the registry served by the API of `url`, or None if the API
+    can't be reached, in which case cached responses are served until their TTL.
+    """
+    try:
+        return request_ct(version_url(url)).json()["dataTimestamp"]
+    except (requests.RequestException, ValueError, KeyError):
+        return None
+
+def fetch_ct(url, stream=False):
+    """
+    Performs the request of `request_ct` on the network. The request waits for the shared limiter,
+    and is retried when the API throttles it.
+    """
+    limiter = get_limiter()
     try:
-        response = requests.get(url)
+        with limiter.slot():
+            for attempt in range(_throttle_retries + 1):
+                limiter.take()
+                # Times the request up to the headers, the handlers time reading the body
+                with instrumentation.span("http.request") as span:
+                    response = get_session().get(url, timeout=_timeout, stream=stream)
+                    span.set(status=response.status_code)
+                if response.status_code not in THROTTLE_STATUSES:
+                    limiter.succeeded()
+                    break
+                limiter.throttled(parse_retry_after(response.headers.get("Retry-After")))
+                if attempt < _throttle_retries:
+                    response.close()
         response.raise_for_status()
     except requests.HTTPError as ex:
         raise ex
@@ -18,18 +199,115 @@ def request_ct(url):
             "Couldn't retrieve the data, check your search expression or try again later."
         )
     else:
+        if stream:
+            # Let urllib3 undo the gzip/deflate transfer encoding while we read
+            response.raw.decode_content = True
         return response
 
+def text_stream(response):
+    """Returns the body of a streamed response as a text stream decoded as it is read."""
+    # Without this urllib3 reports the body as closed once it's fully read, which io wrappers reject
+    response.raw.auto_close = False
+    return io.TextIOWrapper(response.raw, encoding="utf-8", newline="")
+
 def json_handler(url):
     """Returns request in JSON (dict) format and headers"""
-    response = request_ct(url)
-    return response.json(), response.headers
+    # Like in the other handlers, the limiter slot is held while the body streams in too
+    with get_limiter().slot(), instrumentation.span("http.json") as span, request_ct(url, stream=True) as response:
+        body = json.load(text_stream(response))
+        span.add(bytes=response.raw.tell(), rows_out=len(body.get("studies", [])))
+        return body, response.headers
 
 def csv_handler(url):
     """Returns request in CSV (list of records) format and headers"""
-    response = request_ct(url)
-    decoded_content = response.content.decode("utf-8")
     csv.field_size_limit(sys.maxsize)
-    cr = csv.reader(decoded_content.splitlines(), delimiter=",")
-    records = list(cr)
-    return records, response.headers
\ No newline at end of file
+    with get_limiter().slot(), instrumentation.span("http.csv") as span, request_ct(url, stream=True) as response:
+        # Parse the rows while the body streams in instead of copying it to bytes, str and lines first
+        records = list(csv.reader(text_stream(response), delimiter=","))
+        span.add(bytes=response.raw.tell(), rows_out=max(len(records) - 1, 0))
+        return records, response.headers
+
+def csv_columns_handler(url, dtypes=None):
+    """
+    Returns request in CSV format as columns (name -> array) and headers.
+
+    Rows are parsed as the body streams in and written straight into per-column builders, so no
+    list of rows is ever built. Columns listed in `dtypes` as "Int64" become nullable integer arrays,
+    the others object arrays in which empty fields are None and repeated strings are shared.
+    """
+    dtypes = dtypes or {}
+    csv.field_size_limit(sys.maxsize)
+    with get_limiter().slot(), instrumentation.span("http.csv_columns") as span, request_ct(url, stream=True) as response:
+        reader = csv.reader(text_stream(response), delimiter=",")
+        header = next(reader, [])
+        builders = [IntColumnBuilder() if dtypes.get(name) == "Int64" else ColumnBuilder() for name in header]
+        appends = [builder.append for builder in builders]
+        for row in reader:
+            if len(row) < len(appends):
+                # Keep the columns aligned if a row is cut short
+                row += [""] * (len(appends) - len(row))
+            for append, value in zip(appends, row):
+                append(value)
+        columns = {name: builder.finish() for name, builder in zip(header, builders)}
+        span.add(bytes=response.raw.tell(), rows_out=len(next(iter(columns.values()), ())))
+        return columns, response.headers
+
+
+class ColumnBuilder:
+    """Accumulates a column of values, storing each distinct string once."""
+
+    def __init__(self):
+        self.values = []
+        self._strings = {}
+
+    def append(self, value):
+        if value == "":
+            value = None
+        elif isinstance(value, str):
+            value = self._strings.setdefault(value, value)
+        self.values.append(value)
+
+    def finish(self):
+        array = np.empty(len(self.values), dtype=object)
+        array[:] = self.values
+        return array
+
+
+class IntColumnBuilder:
+    """Accumulates a column of integers into a typed buffer, falling back to strings if one doesn't parse."""
+
+    def __init__(self):
+        self.values = array("q")
+        self.missing = bytearray()
+        self._fallback = None
+
+    def append(self, value):
+        if self._fallback is not None:
+            return self._fallback.append(value)
+        if value == "":
+            self.values.append(0)
+            self.missing.append(1)
+            return
+        try:
+            self.values.append(int(value))
+        except ValueError:
+            self._fallback = ColumnBuilder()
+            for number, missing in zip(self.values, self.missing):
+                self._fallback.append("" if missing else str(number))
+            self._fallback.append(value)
+            return
+        self.missing.append(0)
+
+    def finish(self):
+        if self._fallback is not None:
+            return self._fallback.finish()
+        import pandas as pd
+
+        if not self.values:
+            return pd.array([], dtype="Int64")
+        # Views of the buffers, no copy is made
+        return pd.arrays.IntegerArray(np.frombuffer(self.values, dtype=np.int64), np.frombuffer(self.missing, dtype=bool))
+
+
+if os.environ.get("DE_CASE_HTTP_CACHE"):
+    configure_response_cache(os.environ["DE_CASE_HTTP_CACHE"])
@@ -1,5 +1,7 @@
+import os
 from pathlib import Path
 
 HERE = Path(__file__).parent.resolve()
 
-api_cache_root = Path(HERE, "../../cached_data/api_extracts/").resolve()
\ No newline at end of file
+# DE_CASE_CACHE_ROOT moves the cache elsewhere, e.g. to run the pipeline on synthetic data
+api_cache_root = Path(os.environ.get("DE_CASE_CACHE_ROOT") or Path(HERE, "../../cached_data/api_extracts/")).resolve()
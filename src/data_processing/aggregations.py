@@ -0,0 +1,55 @@
+"""Vectorized aggregations shared by the visualisations"""
+import numpy as np
+import pandas as pd
+
+
+def active_years(df, start_col, end_col, by, value_col=None):
+    """
+    Counts the rows active in each year per group of `by`, or sums their `value_col`.
+
+    A row is active in every year from `start_col` to `end_col`, both included. The result is the
+    same as emitting one row per active year and grouping by `by` and the year, but it is computed
+    with difference arrays, so the exploded frame is never built and the cost doesn't grow with the
+    length of the intervals.
+
+    Returns a DataFrame with the `by` columns, "Year" and "Count" (or `value_col`) for every group
+    and year with at least one active row, sorted by `by` and then by year.
+    """
+    df = df.dropna(subset=[start_col, end_col])
+    # Only the groups present, categorical columns would otherwise give every combination of categories
+    grouper = df.groupby(by, sort=True, observed=True)
+    codes = grouper.ngroup().to_numpy()
+    keys = grouper.size().index
+    start = df[start_col].to_numpy(dtype=np.int64)
+    end = df[end_col].to_numpy(dtype=np.int64)
+
+    # Rows in a dropped (missing) group or ending before they start are never active
+    valid = (codes >= 0) & (end >= start)
+    codes, start, end = codes[valid].astype(np.int64), start[valid], end[valid]
+    values = df[value_col].to_numpy()[valid] if value_col is not None else None
+
+    out_columns = list(by) + ["Year", value_col or "Count"]
+    if len(codes) == 0:
+        return pd.DataFrame(columns=out_columns)
+
+    first_year = start.min()
+    width = end.max() - first_year + 2
+    size = len(keys) * width
+    opens = codes * width + (start - first_year)
+    closes = codes * width + (end - first_year + 1)
+
+    def per_year(weights):
+        diff = np.bincount(opens, weights=weights, minlength=size) - np.bincount(closes, weights=weights, minlength=size)
+        return np.cumsum(diff.reshape(len(keys), width), axis=1)[:, :-1]
+
+    active = per_year(None)
+    group_idx, year_idx = np.nonzero(active)
+
+    result = keys[group_idx].to_frame(index=False) if isinstance(keys, pd.MultiIndex) else pd.DataFrame({by[0]: keys[group_idx]})
+    result["Year"] = year_idx + first_year
+    if value_col is None:
+        result["Count"] = active[group_idx, year_idx].astype(np.int64)
+    else:
+        totals = per_year(values.astype(np.float64))[group_idx, year_idx]
+        result[value_col] = totals.round().astype(values.dtype) if np.issubdtype(values.dtype, np.integer) else totals
+    return result
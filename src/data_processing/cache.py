@@ -0,0 +1,223 @@
+"""On-disk cache for the artifacts stored under api_cache_root"""
+import os
+import pandas as pd
+from src.data_processing import api_cache_root
+
+# Columns of the studies CSV export. Everything is text except Enrollment.
+STUDY_SCHEMA = {
+    "NCT Number": "object",
+    "Study Title": "object",
+    "Study URL": "object",
+    "Acronym": "object",
+    "Study Status": "object",
+    "Brief Summary": "object",
+    "Study Results": "object",
+    "Conditions": "object",
+    "Interventions": "object",
+    "Primary Outcome Measures": "object",
+    "Secondary Outcome Measures": "object",
+    "Other Outcome Measures": "object",
+    "Sponsor": "object",
+    "Collaborators": "object",
+    "Sex": "object",
+    "Age": "object",
+    "Phases": "object",
+    "Enrollment": "Int64",
+    "Funder Type": "object",
+    "Study Type": "object",
+    "Study Design": "object",
+    "Other IDs": "object",
+    "Start Date": "object",
+    "Primary Completion Date": "object",
+    "Completion Date": "object",
+    "First Posted": "object",
+    "Results First Posted": "object",
+    "Last Update Posted": "object",
+    "Locations": "object",
+    "Study Documents": "object",
+}
+
+# Explicit schema of every cached artifact. Columns not listed keep their inferred dtype.
+SCHEMAS = {
+    "last_five_years_data": STUDY_SCHEMA,
+    "conditions": {"Condition": "object"},
+    "competitors": {"Competitor": "object"},
+    "condition_index": {"NCT Number": "object", "Condition": "object", "Conditions Hash": "uint64"},
+    "competitor_trials": STUDY_SCHEMA,
+    "geographic_data": {**STUDY_SCHEMA, "Country": "object", "Country Code": "object"},
+}
+
+
+class CsvBackend:
+    """Plain CSV files, readable by anything but re-parsed and re-inferred on every load."""
+
+    suffix = ".csv"
+
+    def read(self, path, columns=None, dtypes=None):
+        dtypes = {column: dtype for column, dtype in (dtypes or {}).items() if columns is None or column in columns}
+        # Only empty fields are missing, the registry has literal values such as the "NA" phase
+        return pd.read_csv(path, usecols=columns, dtype=dtypes, keep_default_na=False, na_values=[""])
+
+    def write(self, df, path):
+        df.to_csv(path, index=False)
+
+    def write_frames(self, frames, path):
+        """Writes frames with the same columns one after the other, returns how many there were."""
+        count = 0
+        with open(path, "w", newline="") as f:
+            for df in frames:
+                df.to_csv(f, index=False, header=count == 0)
+                count += 1
+        return count
+
+
+class ParquetBackend:
+    """Compressed, typed, columnar Parquet files. Reading a subset of columns only decodes those."""
+
+    suffix = ".parquet"
+
+    def __init__(self, compression="zstd"):
+        import pyarrow  # noqa: F401 - fail early if the engine is missing
+
+        self.compression = compression
+
+    def read(self, path, columns=None, dtypes=None):
+        return pd.read_parquet(path, columns=columns)
+
+    def write(self, df, path):
+        df.to_parquet(path, compression=self.compression, index=False)
+
+    def write_frames(self, frames, path):
+        """Writes frames with the same columns as row groups of one file, returns how many there were."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        count = 0
+        writer = schema = None
+        try:
+            for df in frames:
+                if writer is None:
+                    schema = pa.Schema.from_pandas(df, preserve_index=False)
+                    # A column without any value in the first frame holds text in the others
+                    schema = pa.schema(
+                        [field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in schema],
+                        metadata=schema.metadata,
+                    )
+                    writer = pq.ParquetWriter(path, schema, compression=self.compression)
+                writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+                count += 1
+        finally:
+            if writer is not None:
+                writer.close()
+        return count
+
+
+BACKENDS = {"csv": CsvBackend, "parquet": ParquetBackend}
+
+_backend = None
+
+
+def set_backend(name):
+    """Selects the cache format, either "parquet" or "csv"."""
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown cache backend {name!r}, use one of {sorted(BACKENDS)}")
+    _backend = BACKENDS[name]()
+    return _backend
+
+def get_backend():
+    """
+    Returns the active backend. Defaults to the DE_CASE_CACHE_FORMAT environment variable, or to
+    Parquet when pyarrow is installed and CSV otherwise.
+    """
+    if _backend is None:
+        name = os.environ.get("DE_CASE_CACHE_FORMAT")
+        if name is None:
+            try:
+                import pyarrow  # noqa: F401
+                name = "parquet"
+            except ImportError:
+                name = "csv"
+        set_backend(name)
+    return _backend
+
+def artifact_path(name):
+    """Returns the path of an artifact in the active format."""
+    return api_cache_root / f"{name}{get_backend().suffix}"
+
+def exists(name):
+    """Returns whether an artifact is cached, in the active format or as a legacy CSV."""
+    return artifact_path(name).exists() or (api_cache_root / f"{name}.csv").exists()
+
+def read(name, columns=None):
+    """
+    Loads an artifact, optionally only the given columns. A CSV left behind by an older version is
+    converted to the active format on first read.
+    """
+    path = migrate(name)
+    return get_backend().read(path, columns=columns, dtypes=SCHEMAS.get(name))
+
+def migrate(name):
+    """Converts a legacy CSV artifact to the active format if needed and returns the artifact's path."""
+    path = artifact_path(name)
+    if not path.exists():
+        legacy_path = api_cache_root / f"{name}.csv"
+        write(name, CsvBackend().read(legacy_path, dtypes=SCHEMAS.get(name)))
+    return path
+
+def write(name, df):
+    """Stores an artifact in the active format after coercing it to its schema."""
+    df = apply_schema(df, SCHEMAS.get(name, {}))
+    path = artifact_path(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial_path = path.with_name(path.name + ".partial")
+    get_backend().write(df, partial_path)
+    os.replace(partial_path, path)
+    return df
+
+def write_frames(name, frames, columns=()):
+    """
+    Stores an artifact given as an iterable of frames, such as the pages of a download, coercing
+    and writing one frame at a time so only one is held in memory. Without any frame an empty
+    artifact with `columns` is stored. Returns the number of rows written.
+    """
+    schema = SCHEMAS.get(name, {})
+    rows = 0
+
+    def typed():
+        nonlocal rows
+        for df in frames:
+            df = apply_schema(df, schema)
+            rows += len(df)
+            yield df
+
+    path = artifact_path(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial_path = path.with_name(path.name + ".partial")
+    if not get_backend().write_frames(typed(), partial_path):
+        get_backend().write(apply_schema(pd.DataFrame(columns=list(columns)), schema), partial_path)
+    os.replace(partial_path, path)
+    return rows
+
+def export_csv(name, path=None):
+    """Writes an artifact out as CSV, next to the cache by default, and returns the path."""
+    path = path or api_cache_root / f"{name}.export.csv"
+    read(name).to_csv(path, index=False)
+    return path
+
+def apply_schema(df, schema):
+    """
+    Casts the columns of `df` to `schema`. Empty strings become missing values, as they would
+    after a round trip through CSV, so every backend hands out the same frame.
+    """
+    df = df.copy()
+    for column in df.columns:
+        if df[column].dtype == object:
+            df[column] = df[column].where(df[column] != "")
+        dtype = schema.get(column)
+        if dtype is None or str(df[column].dtype) == dtype:
+            continue
+        if dtype == "Int64" and df[column].dtype == object:
+            df[column] = pd.to_numeric(df[column])
+        df[column] = df[column].astype(dtype)
+    return df
@@ -0,0 +1,130 @@
+"""Compact, typed in-memory representation of study frames"""
+import logging
+import sys
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# In-memory type of the study columns. "date" columns become datetime64 (month precision dates fall
+# on the first of the month) and "conditions" the tuple of the "|"-separated conditions. Columns
+# not listed are kept as they are.
+COMPACT_SCHEMA = {
+    "NCT Number": "string[pyarrow]",
+    "Study Status": "category",
+    "Conditions": "conditions",
+    "Interventions": "string[pyarrow]",
+    "Sponsor": "category",
+    "Phases": "category",
+    "Enrollment": "Int32",
+    "Funder Type": "category",
+    "Study Type": "category",
+    "Sex": "category",
+    "Start Date": "date",
+    "Primary Completion Date": "date",
+    "Completion Date": "date",
+    "First Posted": "date",
+    "Results First Posted": "date",
+    "Last Update Posted": "date",
+}
+
+
+def compact(df, schema=COMPACT_SCHEMA, name=None):
+    """
+    Returns a copy of a study frame with its columns converted to their type in `schema`. With a
+    `name`, the memory saved is logged under it, if this module's logger is enabled for INFO.
+    """
+    columns = {}
+    for column in df.columns:
+        kind = schema.get(column)
+        values = df[column]
+        if kind is None:
+            columns[column] = values
+        elif kind == "date":
+            columns[column] = to_dates(values)
+        elif kind == "conditions":
+            columns[column] = split_conditions(values)
+        else:
+            columns[column] = values.astype(kind)
+    typed = pd.DataFrame(columns, index=df.index)
+    if name is not None and logger.isEnabledFor(logging.INFO):
+        log_memory_report(name, memory_report(df, typed))
+    return typed
+
+def to_dates(values):
+    """Parses "YYYY-MM-DD" and "YYYY-MM" dates. Every distinct date is parsed once."""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    categorical = values.astype("category")
+    dates = categorical.cat.categories.astype(str)
+    dates = dates.where(dates.str.len() > 7, dates + "-01")
+    parsed = pd.to_datetime(dates, format="%Y-%m-%d", errors="coerce").to_numpy()
+    # Missing dates have code -1, which picks the NaT appended last
+    lookup = np.append(parsed, np.datetime64("NaT", "ns"))
+    return pd.Series(lookup[categorical.cat.codes.to_numpy()], index=values.index, name=values.name)
+
+def split_conditions(values):
+    """
+    Returns the conditions of every study as a tuple. Studies listing the same conditions share
+    the same tuple, and the tuples share the condition strings.
+    """
+    if is_split(values):
+        return values
+    categorical = values.astype("category")
+    strings = {}
+    # Missing conditions have code -1, which picks the empty tuple appended last
+    tuples = np.empty(len(categorical.cat.categories) + 1, dtype=object)
+    tuples[-1] = ()
+    for i, conditions in enumerate(categorical.cat.categories):
+        tuples[i] = tuple(strings.setdefault(condition, condition) for condition in conditions.split("|"))
+    return pd.Series(tuples[categorical.cat.codes.to_numpy()], index=values.index, name=values.name)
+
+def is_split(values):
+    """Whether a Conditions column already holds tuples of conditions."""
+    first = values.first_valid_index()
+    return first is not None and isinstance(values[first], tuple)
+
+def memory_usage(df):
+    """
+    Returns the bytes held by every column of a frame. Unlike `DataFrame.memory_usage(deep=True)`,
+    objects referenced several times, such as shared strings and tuples, are counted once.
+    """
+    usage = {}
+    for column in df.columns:
+        values = df[column]
+        if values.dtype != object:
+            usage[column] = int(values.memory_usage(index=False, deep=True))
+            continue
+        seen = set()
+        total = values.to_numpy().nbytes
+        for value in values.to_numpy():
+            for item in (value, *value) if isinstance(value, tuple) else (value,):
+                if id(item) not in seen:
+                    seen.add(id(item))
+                    total += sys.getsizeof(item)
+        usage[column] = total
+    return usage
+
+def memory_report(before, after):
+    """
+    Returns the memory used by every column of two frames, and in total, as
+    {column: {"before": bytes, "after": bytes, "ratio": before / after}}.
+    """
+    before_usage, after_usage = memory_usage(before), memory_usage(after)
+    report = {}
+    for column in after_usage:
+        report[column] = {"before": before_usage.get(column, 0), "after": after_usage[column]}
+    report["total"] = {
+        "before": sum(before_usage.values()),
+        "after": sum(after_usage.values()),
+    }
+    for usage in report.values():
+        usage["ratio"] = usage["before"] / usage["after"] if usage["after"] else None
+    return report
+
+def log_memory_report(name, report):
+    total = report["total"]
+    logger.info(
+        "%s takes %.1f MB instead of %.1f MB (%.1fx smaller)",
+        name, total["after"] / 2**20, total["before"] / 2**20, total["ratio"] or 0,
+    )
@@ -0,0 +1,109 @@
+"""Competitor discovery for any number of sponsors at once, with sparse sponsor x condition matrices"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from src.data_processing import compact
+
+
+class CompetitorMatrix:
+    """
+    Sparse incidence matrices of a study snapshot, built in one pass, from which the disease areas
+    and the competitors of any set of sponsors are computed with a couple of matrix products.
+
+    The definitions are those of the pipeline's "conditions" and "competitors" artifacts:
+
+    - the conditions of a sponsor are the ones found more than `condition_threshold` times in
+      its distinct "Conditions" values, other than the `excluded` ones;
+    - the competitors of a sponsor are the other sponsors with more than `trial_threshold`
+      `funder_type` studies listing at least one of those conditions.
+    """
+
+    def __init__(self, df, excluded=(), funder_type="INDUSTRY", condition_threshold=1, trial_threshold=10):
+        self.condition_threshold = condition_threshold
+        self.trial_threshold = trial_threshold
+
+        df = df[["Sponsor", "Conditions", "Funder Type"]].dropna(subset=["Sponsor", "Conditions"]).reset_index(drop=True)
+        sponsor_codes, self.sponsors = pd.factorize(df["Sponsor"], sort=True)
+        self.sponsors = pd.Index(self.sponsors)
+
+        conditions = df["Conditions"] if compact.is_split(df["Conditions"]) else df["Conditions"].str.split("|")
+        exploded = conditions.explode()
+        rows = exploded.index.to_numpy()
+        condition_codes, self.conditions = pd.factorize(exploded.to_numpy(dtype=object), sort=True)
+        self.conditions = pd.Index(self.conditions)
+        present = condition_codes >= 0
+        rows, condition_codes = rows[present], condition_codes[present]
+        n_studies, n_sponsors, n_conditions = len(df), len(self.sponsors), len(self.conditions)
+
+        # Studies x conditions, 1 where a study lists a condition
+        self.study_conditions = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, condition_codes)), shape=(n_studies, n_conditions))
+        self.study_conditions.data[:] = 1
+
+        # Sponsors x conditions, how often a condition appears in the distinct Conditions of a sponsor
+        first = ~df.duplicated(["Sponsor", "Conditions"]).to_numpy()[rows]
+        self.sponsor_conditions = sparse.csr_matrix(
+            (np.ones(first.sum(), dtype=np.int32), (sponsor_codes[rows[first]], condition_codes[first])),
+            shape=(n_sponsors, n_conditions))
+        self.sponsor_conditions.sum_duplicates()
+        if len(excluded):
+            kept = sparse.diags((~self.conditions.isin(excluded)).astype(np.int32), dtype=np.int32)
+            self.sponsor_conditions = self.sponsor_conditions @ kept
+
+        # Sponsors x studies, 1 for the `funder_type` studies of a sponsor
+        counted = np.flatnonzero((df["Funder Type"] == funder_type).to_numpy())
+        self.sponsor_studies = sparse.csr_matrix(
+            (np.ones(len(counted), dtype=np.int32), (sponsor_codes[counted], counted)), shape=(n_sponsors, n_studies))
+
+    def __codes(self, sponsors):
+        codes = self.sponsors.get_indexer(sponsors)
+        missing = [sponsor for sponsor, code in zip(sponsors, codes) if code < 0]
+        if missing:
+            raise KeyError(f"Unknown sponsors: {missing}")
+        return codes
+
+    def areas(self, sponsors=None):
+        """Returns the conditions x sponsors 0/1 matrix of the conditions of `sponsors` (all by default)."""
+        counts = self.sponsor_conditions if sponsors is None else self.sponsor_conditions[self.__codes(sponsors)]
+        return (counts > self.condition_threshold).astype(np.int32).T.tocsc()
+
+    def conditions_of(self, sponsor):
+        """Returns the conditions of a sponsor, the most frequent first."""
+        counts = self.sponsor_conditions[self.__codes([sponsor])[0]].toarray().ravel()
+        selected = np.flatnonzero(counts > self.condition_threshold)
+        order = np.lexsort((self.conditions[selected], -counts[selected]))
+        return self.conditions[selected[order]].tolist()
+
+    def scores(self, sponsors=None):
+        """
+        Returns the sponsors x `sponsors` (all by default) sparse matrix of overlap scores: the
+        number of `funder_type` studies of each sponsor listing a condition of each of `sponsors`.
+        A sponsor's score against itself is 0.
+
+        Scoring every sponsor pair is one product over the whole snapshot; the memory it takes
+        grows with the number of (study, sponsor) pairs in common disease areas.
+        """
+        codes = np.arange(len(self.sponsors)) if sponsors is None else self.__codes(sponsors)
+        # Studies x sponsors, 1 where a study lists a condition of the sponsor
+        in_area = (self.study_conditions @ self.areas(None if sponsors is None else sponsors)).tocsc()
+        in_area.data[:] = 1
+        scores = (self.sponsor_studies @ in_area).tolil()
+        scores[codes, np.arange(len(codes))] = 0
+        return scores.tocsc()
+
+    def competitors(self, sponsors):
+        """
+        Returns the competitors of each of `sponsors` as {sponsor: [competitor, ...]}, the competitor
+        with the highest score first, or the list of competitors of a single sponsor given as a string.
+        """
+        if isinstance(sponsors, str):
+            return self.competitors([sponsors])[sponsors]
+        scores = self.scores(sponsors)
+        result = {}
+        for j, sponsor in enumerate(sponsors):
+            column = scores.getcol(j).tocoo()
+            kept = column.data > self.trial_threshold
+            rows, values = column.row[kept], column.data[kept]
+            order = np.lexsort((self.sponsors[rows], -values))
+            result[sponsor] = self.sponsors[rows[order]].tolist()
+        return result
@@ -0,0 +1,137 @@
+"""Process-wide, memoized access to the datasets the dashboard figures are built from"""
+import threading
+from src.data_processing import compact, pipeline
+from src.data_processing import utils
+from src.data_processing.indexes import TrialIndex
+
+# Dataset -> cached artifacts whose content it is derived from
+DEPENDENCIES = {
+    "conditions": ("conditions",),
+    "competitor_trials": ("competitor_trials",),
+    "competitor_trials_one_cond": ("conditions", "competitor_trials"),
+    "geographic_data": ("geographic_data",),
+    "trial_index": ("conditions", "competitor_trials"),
+}
+
+
+class DataContext:
+    """
+    Loads each dataset once per process and hands out views of it.
+
+    Every dataset is stored with the content hashes of the artifacts it was derived from and of
+    everything upstream of them. When the pipeline manifest changes on disk, datasets whose hashes
+    moved are dropped and reloaded on next access, which brings their artifacts up to date too:
+    a synced snapshot is picked up before the artifacts derived from it are rebuilt. `invalidate`
+    drops datasets explicitly.
+
+    DataFrames are handed out as shallow copies: adding or replacing columns on them doesn't affect
+    the shared frame, but values must not be modified in place. The competitor trials are kept in
+    their compact, typed form (see `compact.COMPACT_SCHEMA`).
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._datasets = {}
+        self._manifest_mtime = None
+
+    def get(self, name):
+        """Returns a view of a dataset, loading it on first access."""
+        with self._lock:
+            self._drop_stale()
+            if name not in self._datasets:
+                value = self._load(name)
+                self._datasets[name] = (self._version(name, pipeline.read_manifest()), value)
+            return self._view(self._datasets[name][1])
+
+    def invalidate(self, name=None):
+        """Drops one dataset, or all of them, so the next access reloads it."""
+        with self._lock:
+            if name is None:
+                self._datasets.clear()
+            else:
+                self._datasets.pop(name, None)
+
+    def versions(self):
+        """Returns the version (upstream content hashes) of every loaded dataset."""
+        with self._lock:
+            return {name: version for name, (version, _) in self._datasets.items()}
+
+    def _load(self, name):
+        if name == "conditions":
+            return utils.get_conditions()
+        if name == "competitor_trials":
+            return compact.compact(utils.get_competitor_trials(), name="competitor_trials")
+        if name == "competitor_trials_one_cond":
+            return utils.get_competitor_trials_one_cond(
+                competitor_trials_df=self._datasets_value("competitor_trials"),
+                conditions=self._datasets_value("conditions"),
+            )
+        if name == "geographic_data":
+            return utils.get_geographic_data()
+        if name == "trial_index":
+            return TrialIndex(
+                self._datasets_value("competitor_trials"),
+                groups=self._datasets_value("competitor_trials_one_cond"),
+            )
+        raise KeyError(f"Unknown dataset {name!r}")
+
+    def _datasets_value(self, name):
+        self.get(name)
+        return self._datasets[name][1]
+
+    @staticmethod
+    def _version(name, manifest):
+        return tuple(
+            (artifact, pipeline.current_hash(artifact, manifest)) for artifact in upstream(DEPENDENCIES[name])
+        )
+
+    def _drop_stale(self):
+        path = pipeline.manifest_path()
+        mtime = path.stat().st_mtime if path.exists() else None
+        if mtime == self._manifest_mtime:
+            return
+        self._manifest_mtime = mtime
+        manifest = pipeline.read_manifest()
+        for name, (version, _) in list(self._datasets.items()):
+            if version != self._version(name, manifest):
+                del self._datasets[name]
+
+    @staticmethod
+    def _view(value):
+        if isinstance(value, list):
+            return list(value)
+        if isinstance(value, TrialIndex):
+            return value
+        return value.copy(deep=False)
+
+
+def upstream(artifacts):
+    """Returns the sorted names of `artifacts` and of every pipeline node upstream of them."""
+    seen = set()
+    pending = list(artifacts)
+    while pending:
+        name = pending.pop()
+        if name not in seen:
+            seen.add(name)
+            pending.extend(pipeline.NODES[name].deps)
+    return sorted(seen)
+
+
+data_context = DataContext()
+
+
+def get_conditions():
+    return data_context.get("conditions")
+
+def get_competitor_trials(columns=None):
+    df = data_context.get("competitor_trials")
+    return df if columns is None else df[columns]
+
+def get_competitor_trials_one_cond():
+    return data_context.get("competitor_trials_one_cond")
+
+def get_geographic_data():
+    return data_context.get("geographic_data")
+
+def get_trial_index():
+    return data_context.get("trial_index")
@@ -0,0 +1,210 @@
+"""On-disk cache of the rendered dashboard figures"""
+from collections import OrderedDict
+from importlib.util import find_spec
+from pathlib import Path
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from src.data_processing import api_cache_root, pipeline
+from src.data_processing import utils  # noqa: F401 - registers the pipeline nodes
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+# Modules whose figure is being rebuilt in the background
+_rebuilding = set()
+
+# Number of per-sponsor figures kept in memory
+FRAGMENT_CACHE_SIZE = 256
+# (module, figure key, sponsor) -> figure, least recently used first
+_fragments = OrderedDict()
+
+# Packages whose code the figures are computed with, besides the visualisation modules
+CODE_PACKAGES = ["src.data_processing"]
+
+
+def figure_cache_root():
+    return api_cache_root.parent / "figures"
+
+def figure_path(module_name):
+    return figure_cache_root() / f"{module_name}.json.gz"
+
+def figure_key(module_name, inputs):
+    """
+    Returns the version of a figure: a hash of the content of its `inputs`, of the source of the
+    module building it and of the `CODE_PACKAGES` it's computed with. `inputs` are pipeline
+    artifacts or paths of other files the figure is built from. Returns None if one of the
+    artifacts is missing or stale, as the figure would change once it's brought up to date.
+    """
+    manifest = pipeline.read_manifest()
+    versions = {}
+    for name in inputs:
+        if name in pipeline.NODES:
+            if pipeline.is_stale(name, manifest):
+                return None
+            versions[name] = pipeline.current_hash(name, manifest)
+        else:
+            versions[name] = pipeline.file_hash(name)
+        if versions[name] is None:
+            return None
+    versions["code"] = pipeline.file_hash(find_spec(module_name).origin)
+    for package_name in CODE_PACKAGES:
+        versions[package_name] = package_hash(package_name)
+    return hashlib.sha256(json.dumps(versions, sort_keys=True).encode()).hexdigest()
+
+def package_hash(package_name):
+    """Returns a hash of the source of every module of a package."""
+    directory = Path(find_spec(package_name).origin).parent
+    hashes = {path.name: pipeline.file_hash(path) for path in sorted(directory.glob("*.py"))}
+    return hashlib.sha256(json.dumps(hashes, sort_keys=True).encode()).hexdigest()
+
+def fragment_dir(module_name, version):
+    return figure_cache_root() / "sponsors" / module_name / version
+
+def fragment_path(module_name, version, sponsor):
+    """Path of the figure of a sponsor, or of the list of sponsors when `sponsor` is None."""
+    if sponsor is None:
+        return fragment_dir(module_name, version) / "sponsors.json.gz"
+    return fragment_dir(module_name, version) / f"{hashlib.sha256(sponsor.encode()).hexdigest()[:32]}.json.gz"
+
+def read_figure(module_name):
+    """Returns the cached key and figure (as a dict) of a module, or (None, None)."""
+    entry = read_json_gz(figure_path(module_name))
+    if entry is None:
+        return None, None
+    return entry["key"], entry["figure"]
+
+def write_figure(module_name, key, figure):
+    """Stores a figure (a plotly Figure or dict) with its key and returns it as a dict."""
+    import plotly.io as pio
+
+    figure = json.loads(pio.to_json(figure, validate=False))
+    write_json_gz({"key": key, "figure": figure}, figure_path(module_name))
+    return figure
+
+def read_json_gz(path):
+    """Returns the content of a gzipped JSON file, or None if it doesn't exist."""
+    try:
+        with gzip.open(path, "rt") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def write_json_gz(data, path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Unique per process and thread, several dashboard replicas may share the cache
+    partial_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.partial")
+    with gzip.open(partial_path, "wt") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(partial_path, path)
+
+def build_figure(module_name, inputs):
+    """Builds a figure with the module's main(), caches it and returns it."""
+    from importlib import import_module
+
+    # Bring the inputs up to date first, the key is only known once they are
+    ensure_inputs(inputs)
+    figure = import_module(module_name).main()
+    return write_figure(module_name, figure_key(module_name, inputs), figure)
+
+def ensure_inputs(inputs):
+    """Brings the pipeline artifacts among `inputs` up to date."""
+    for name in inputs:
+        if name in pipeline.NODES:
+            pipeline.ensure(name)
+
+def get_figure(module_name, inputs):
+    """
+    Returns the figure built by `module_name`.main() from `inputs` (see `figure_key`).
+
+    A cached figure whose key still matches is returned as is. An outdated one is returned too, while
+    it's rebuilt in a background thread, so only a figure that was never built is built on the spot.
+    """
+    cached_key, figure = read_figure(module_name)
+    if figure is None:
+        return build_figure(module_name, inputs)
+
+    key = figure_key(module_name, inputs)
+    if key is None or key != cached_key:
+        rebuild_in_background(module_name, inputs)
+    return figure
+
+def rebuild_in_background(module_name, inputs):
+    """Starts rebuilding a figure in a background thread, unless it's already being rebuilt."""
+    with _lock:
+        if module_name in _rebuilding:
+            return
+        _rebuilding.add(module_name)
+
+    def rebuild():
+        try:
+            build_figure(module_name, inputs)
+        except Exception:
+            logger.exception("Couldn't rebuild the figure of %s, the cached one is kept", module_name)
+        finally:
+            with _lock:
+                _rebuilding.discard(module_name)
+
+    threading.Thread(target=rebuild, daemon=True).start()
+
+def get_sponsor_figure(module_name, inputs, sponsor):
+    """
+    Returns the figure built by `module_name`.main(sponsor=...) with only the traces of `sponsor`, or
+    the sponsors that can be selected (`module_name`.sponsors()) when `sponsor` is None.
+
+    Results are stored on disk under the figure key, shared by restarts and replicas, and the most
+    recent ones kept in an in-memory LRU, so a sponsor is only rendered once per version of the
+    data and code. If an input changes again while it's brought up to date, there's no version to
+    store the result under and it's rendered without caching.
+    """
+    from importlib import import_module
+    import plotly.io as pio
+
+    def render():
+        module = import_module(module_name)
+        if sponsor is None:
+            return [str(name) for name in module.sponsors()]
+        return json.loads(pio.to_json(module.main(sponsor=sponsor), validate=False))
+
+    version = figure_key(module_name, inputs)
+    if version is None:
+        ensure_inputs(inputs)
+        version = figure_key(module_name, inputs)
+        if version is None:
+            return render()
+    key = (module_name, version, sponsor)
+    with _lock:
+        if key in _fragments:
+            _fragments.move_to_end(key)
+            return _fragments[key]
+
+    path = fragment_path(module_name, version, sponsor)
+    value = read_json_gz(path)
+    if value is None:
+        value = render()
+        try:
+            if not path.parent.exists():
+                prune_fragments(module_name, version)
+            write_json_gz(value, path)
+        except OSError:
+            # Another replica may be pruning this version, the figure is rendered again next time
+            logger.warning("Couldn't store the %s figure of %s", module_name, sponsor, exc_info=True)
+
+    with _lock:
+        _fragments[key] = value
+        while len(_fragments) > FRAGMENT_CACHE_SIZE:
+            _fragments.popitem(last=False)
+    return value
+
+def prune_fragments(module_name, version):
+    """Deletes the stored sponsor figures of a module built for other versions than `version`."""
+    directory = fragment_dir(module_name, version).parent
+    if not directory.exists():
+        return
+    for path in directory.iterdir():
+        if path.name != version:
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,167 @@
+"""In-memory indexes over the study snapshot"""
+import numpy as np
+import pandas as pd
+
+
+class ConditionIndex:
+    """
+    Inverted index from each condition term to the studies listing it.
+
+    Backed by a table with one row per (NCT Number, Condition) pair, which is what gets persisted. The
+    hash of every study's full "Conditions" string is kept alongside so the table can be updated
+    incrementally when the snapshot changes.
+    """
+
+    COLUMNS = ["NCT Number", "Condition", "Conditions Hash"]
+
+    def __init__(self, table):
+        self.table = table
+        self._postings = None
+
+    @classmethod
+    def build(cls, df, previous=None):
+        """
+        Indexes the "NCT Number" and "Conditions" columns of `df`. With the `previous` index table, only
+        studies that are new or whose conditions changed are re-split.
+        """
+        studies = df[["NCT Number", "Conditions"]].dropna(subset=["NCT Number"])
+        hashes = pd.util.hash_array(studies["Conditions"].fillna("").to_numpy(dtype=object))
+        studies = studies.assign(**{"Conditions Hash": hashes})
+
+        if previous is not None and len(previous):
+            known = previous.drop_duplicates("NCT Number").set_index("NCT Number")["Conditions Hash"]
+            unchanged = studies["Conditions Hash"].to_numpy() == known.reindex(studies["NCT Number"]).to_numpy()
+            kept = previous[previous["NCT Number"].isin(studies.loc[unchanged, "NCT Number"])]
+            studies = studies[~unchanged]
+        else:
+            kept = previous.iloc[:0] if previous is not None else None
+
+        exploded = studies.assign(Condition=studies["Conditions"].str.split("|")).explode("Condition")
+        exploded = exploded.dropna(subset=["Condition"])[cls.COLUMNS]
+        table = exploded if kept is None else pd.concat([kept[cls.COLUMNS], exploded], ignore_index=True)
+        return cls(table.reset_index(drop=True))
+
+    @property
+    def postings(self):
+        """Condition term -> positions in `table` of the rows for that term."""
+        if self._postings is None:
+            self._postings = self.table.groupby("Condition", sort=False).indices
+        return self._postings
+
+    def nct_numbers(self, conditions):
+        """Returns the NCT Numbers of the studies listing any of `conditions`, as a set union."""
+        rows = [self.postings[condition] for condition in conditions if condition in self.postings]
+        if not rows:
+            return np.array([], dtype=object)
+        return pd.unique(self.table["NCT Number"].to_numpy()[np.concatenate(rows)])
+
+    def mask(self, nct_numbers, conditions):
+        """Returns a boolean mask of which of `nct_numbers` list any of `conditions`."""
+        return pd.Series(nct_numbers).isin(self.nct_numbers(conditions)).to_numpy()
+
+    def positions(self, nct_numbers, conditions):
+        """Returns the positions within `nct_numbers` (e.g. a snapshot's rows) of studies listing any of `conditions`."""
+        return np.flatnonzero(self.mask(nct_numbers, conditions))
+
+
+class TrialIndex:
+    """
+    Multi-dimension index over a set of trials for answering conjunctive filters without scanning.
+
+    Every dimension is encoded once as categorical codes, and for every value the sorted positions
+    of the rows having it are kept. A filter such as ``select(sponsor=["A", "B"], phases="PHASE3")``
+    is answered by a union of the value postings within each dimension and an intersection across
+    dimensions. "group" can hold several values per trial, taken from the exploded one-condition frame.
+    """
+
+    DIMENSIONS = {
+        "sponsor": "Sponsor",
+        "funder_type": "Funder Type",
+        "phases": "Phases",
+        "status": "Study Status",
+        "start_year": "Start Date",
+    }
+
+    def __init__(self, df, groups=None):
+        self.df = df.reset_index(drop=True)
+        self._codes = {}
+        self._postings = {}
+        for dimension, column in self.DIMENSIONS.items():
+            if column not in self.df.columns:
+                continue
+            values = self.df[column]
+            if dimension == "start_year":
+                if pd.api.types.is_datetime64_any_dtype(values):
+                    values = values.dt.year.astype("Int64")
+                else:
+                    values = pd.to_numeric(values.astype("string").str[:4], errors="coerce").astype("Int64")
+            self._add(dimension, np.arange(len(self.df)), values)
+
+        if groups is not None:
+            rows = pd.Index(self.df["NCT Number"]).get_indexer(groups["NCT Number"])
+            pairs = pd.DataFrame({"row": rows, "Group": groups["Group"].to_numpy()})
+            pairs = pairs[pairs["row"] >= 0].drop_duplicates()
+            self._add("group", pairs["row"].to_numpy(), pairs["Group"])
+
+    def _add(self, dimension, rows, values):
+        codes, categories = pd.factorize(values, sort=True)
+        present = codes >= 0
+        rows, codes = rows[present], codes[present]
+        order = np.lexsort((rows, codes))
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(categories)))])
+        self._codes[dimension] = (rows, codes)
+        self._postings[dimension] = (pd.Index(categories), rows[order], offsets)
+
+    @property
+    def dimensions(self):
+        return list(self._postings)
+
+    def values(self, dimension):
+        """Returns the distinct values of a dimension."""
+        return list(self._postings[dimension][0])
+
+    def postings(self, dimension, value):
+        """Returns the sorted positions of the rows having `value` in `dimension`."""
+        categories, rows, offsets = self._postings[dimension]
+        code = categories.get_indexer([value])[0]
+        if code < 0:
+            return rows[:0]
+        return rows[offsets[code]:offsets[code + 1]]
+
+    def select(self, **filters):
+        """
+        Returns the sorted row positions matching every filter. Each filter maps a dimension to a value
+        or to a list of accepted values.
+        """
+        result = None
+        for dimension, accepted in filters.items():
+            if dimension not in self._postings:
+                raise KeyError(f"Unknown dimension {dimension!r}, use one of {self.dimensions}")
+            if not isinstance(accepted, (list, tuple, set)):
+                accepted = [accepted]
+            postings = [self.postings(dimension, value) for value in accepted]
+            if not postings:
+                # No accepted value, no row matches
+                rows = self._postings[dimension][1][:0]
+            else:
+                rows = np.unique(np.concatenate(postings)) if len(postings) > 1 else postings[0]
+            result = rows if result is None else np.intersect1d(result, rows, assume_unique=True)
+            if len(result) == 0:
+                break
+        return np.arange(len(self.df)) if result is None else result
+
+    def rows(self, **filters):
+        """Returns the trials matching every filter."""
+        return self.df.iloc[self.select(**filters)]
+
+    def count(self, **filters):
+        """Returns the number of trials matching every filter."""
+        return len(self.select(**filters))
+
+    def counts(self, dimension, **filters):
+        """Returns the number of matching trials per value of `dimension`."""
+        categories = self._postings[dimension][0]
+        rows, codes = self._codes[dimension]
+        if filters:
+            codes = codes[np.isin(rows, self.select(**filters), assume_unique=dimension != "group")]
+        return pd.Series(np.bincount(codes, minlength=len(categories)), index=categories, name="Count")
@@ -0,0 +1,167 @@
+"""Dependency tracking for the cached artifacts of the data processing pipeline"""
+import hashlib
+import json
+import os
+import threading
+import pandas as pd
+from src.data_processing import api_cache_root, cache
+from src import instrumentation
+
+# name -> Node, filled in by the @node decorator
+NODES = {}
+
+_lock = threading.RLock()
+
+
+class Node:
+    """A cached artifact, the artifacts it is computed from and the parameters it depends on."""
+
+    def __init__(self, name, build, deps=(), params=None, fields=()):
+        self.name = name
+        self.build = build
+        self.deps = tuple(deps)
+        self.params = params or (lambda: {})
+        self.fields = tuple(fields)
+
+
+def node(name, deps=(), params=None, fields=()):
+    """
+    Registers the decorated function as the builder of artifact `name`. It must return a DataFrame,
+    or an iterator of DataFrames (e.g. the pages of a download) that are written as they come.
+    `params` is a function returning the (JSON serialisable) parameters the artifact depends on.
+    `fields` are the study columns the artifact reads, or hands on to its consumers.
+    """
+    def decorator(build):
+        NODES[name] = Node(name, build, deps, params, fields)
+        return build
+    return decorator
+
+def required_fields(name):
+    """Returns the union of the fields declared by `name` and every node downstream of it."""
+    fields = set(NODES[name].fields)
+    for other in NODES.values():
+        if name in other.deps:
+            fields |= required_fields(other.name)
+    return fields
+
+def manifest_path():
+    return api_cache_root / "manifest.json"
+
+def read_manifest():
+    """Returns the recorded state of every artifact."""
+    path = manifest_path()
+    if not path.exists():
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+def write_manifest(manifest):
+    path = manifest_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial_path = path.with_name(path.name + ".partial")
+    with open(partial_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(partial_path, path)
+
+def file_hash(path):
+    """Returns the SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def record(name, dep_hashes=None, params=None):
+    """
+    Records the content hash of a freshly written artifact, with the upstream hashes and parameters
+    it was computed from. Returns the content hash.
+    """
+    path = cache.artifact_path(name)
+    stat = path.stat()
+    entry = {
+        "hash": file_hash(path),
+        "deps": dep_hashes or {},
+        "params": params or {},
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+    }
+    with _lock:
+        manifest = read_manifest()
+        manifest[name] = entry
+        write_manifest(manifest)
+    return entry["hash"]
+
+def current_hash(name, manifest):
+    """
+    Returns the recorded content hash of a cached artifact, or None when it isn't cached or the file
+    no longer matches the size and modification time recorded with the hash.
+    """
+    if not cache.exists(name):
+        return None
+    path = cache.migrate(name)
+    entry = manifest.get(name)
+    stat = path.stat()
+    if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+        return entry["hash"]
+    return None
+
+def is_stale(name, manifest=None):
+    """Returns whether an artifact is missing or was computed from different upstream content or parameters."""
+    manifest = read_manifest() if manifest is None else manifest
+    node = NODES[name]
+    entry = manifest.get(name)
+    if not cache.exists(name):
+        return True
+    if not node.deps:
+        # Root artifacts are refreshed explicitly, they only go stale when their parameters change
+        return entry is not None and entry["params"] != node.params()
+    if current_hash(name, manifest) is None:
+        return True
+    dep_hashes = {dep: manifest.get(dep, {}).get("hash") for dep in node.deps}
+    return entry["deps"] != dep_hashes or entry["params"] != node.params() or any(is_stale(dep, manifest) for dep in node.deps)
+
+def ensure(name, **build_kwargs):
+    """
+    Brings an artifact and everything upstream of it up to date, rebuilding only the nodes whose
+    inputs changed. Returns the content hash and the DataFrame if it was rebuilt by a builder
+    returning one, else None.
+    `build_kwargs` are passed on to the builder of `name` (not to its upstream nodes).
+    """
+    node = NODES[name]
+    dep_hashes = {dep: ensure(dep)[0] for dep in node.deps}
+
+    with _lock:
+        manifest = read_manifest()
+        content_hash = current_hash(name, manifest)
+        entry = manifest.get(name)
+        params = node.params()
+        if content_hash is not None and entry["deps"] == dep_hashes and entry["params"] == params:
+            return content_hash, None
+
+        if not node.deps and cache.exists(name) and (entry is None or entry["params"] == params):
+            # A root artifact written outside the pipeline (or before it existed), adopt it as is
+            return record(name, params=params), None
+
+        with instrumentation.span(f"pipeline.build.{name}") as span:
+            built = node.build(**build_kwargs)
+            if isinstance(built, pd.DataFrame):
+                df = cache.write(name, built)
+                span.add(rows_out=len(df))
+            else:
+                df = None
+                span.add(rows_out=cache.write_frames(name, built))
+        return record(name, dep_hashes, params), df
+
+def load(name, columns=None, **build_kwargs):
+    """Returns an up to date artifact, optionally only the given columns."""
+    _, df = ensure(name, **build_kwargs)
+    if df is None:
+        return cache.read(name, columns=columns)
+    return df if columns is None else df[columns]
+
+def invalidate(name):
+    """Forgets the recorded state of an artifact so the next load rebuilds it."""
+    with _lock:
+        manifest = read_manifest()
+        manifest.pop(name, None)
+        write_manifest(manifest)
@@ -1,131 +1,360 @@
 from datetime import datetime, timedelta
+import hashlib
 import json
+import numpy as np
 import pandas as pd
-import pycountry
+import shutil
 from src.api_client.client import ClinicalTrials
+from src.api_client.fields import get_field_registry
 import os
-from src.data_processing import api_cache_root
+from src.data_processing import api_cache_root, cache, compact, pipeline
+from src.data_processing.competition import CompetitorMatrix
+from src.data_processing.indexes import ConditionIndex
+from src.instrumentation import instrument
+
+SPONSOR = "Novo Nordisk A/S"
+
+EXCLUDED_CONDITIONS = ["Healthy Participants", "Healthy Volunteers"]
+
+WINDOW_DAYS = 5*365
 
 # Calculate the start date (five years ago)
-start_date = (datetime.now() - timedelta(days=5*365)).strftime('%Y-%m-%d')
+start_date = (datetime.now() - timedelta(days=WINDOW_DAYS)).strftime('%Y-%m-%d')
 
 today = datetime.now().strftime('%Y-%m-%d')
 
 SEARCH_EXPR = f"AREA[StartDate]RANGE[{start_date}, {today}]"
 
+# Study columns kept in the competitor trials for the visualisations and the trial index
+COMPETITOR_TRIAL_FIELDS = [
+    "NCT Number", "Sponsor", "Conditions", "Funder Type", "Study Status", "Phases",
+    "Interventions", "Enrollment", "Start Date", "Completion Date",
+]
 
-def get_last_five_years_data():
+
+@instrument()
+def get_last_five_years_data(workers=8, sync=False, columns=None):
     """
     Returns data from the last five years. If the data is cached, it loads the data from the cache.
-    Otherwise, it fetches the data, caches it, and then returns it.
+    Otherwise, it fetches the data with `workers` parallel date shards, caches it, and then returns it.
+    With `sync=True` a cached snapshot is first brought up to date with `sync_last_five_years_data`.
+    `columns` restricts the returned frame, and what is read from the cache, to those columns.
+    """
+    if sync:
+        df = sync_last_five_years_data(workers=workers)
+        return df if columns is None else df[columns]
+
+    return pipeline.load("last_five_years_data", columns=columns, workers=workers)
+
+@instrument()
+def get_compact_snapshot(columns=None):
+    """
+    Returns the five year snapshot as a compact, typed frame (see `compact.COMPACT_SCHEMA`):
+    low cardinality columns are categorical, dates datetime64, Enrollment a nullable Int32 and
+    Conditions tuples of conditions. The memory saved is logged at INFO level.
     """
-    cache_path = api_cache_root / "last_five_years_data.csv"
+    return compact.compact(get_last_five_years_data(columns=columns), name="last_five_years_data")
 
-    if cache_path.exists():
-        return pd.read_csv(cache_path)
+def snapshot_fields():
+    """
+    Returns the study columns fetched for the snapshot: the union of the fields declared by the
+    pipeline stages reading it, in the order of the export.
+    """
+    return get_field_registry().ordered(pipeline.required_fields("last_five_years_data"))
+
+def snapshot_params():
+    return {"window_days": WINDOW_DAYS, "fields": snapshot_fields()}
+
+@pipeline.node("last_five_years_data", params=snapshot_params, fields=["NCT Number", "Start Date"])
+def build_last_five_years_data(workers=8):
+    return download_and_record(workers)
+
+def sync_last_five_years_data(workers=8):
+    """
+    Incrementally refreshes the cached five year snapshot.
+
+    Only studies updated since the last sync, or starting after the end of the window of the last
+    sync, are downloaded and upserted by NCT Number, and studies that have slid out of the window
+    are dropped. If the API's `dataTimestamp` hasn't moved since the last sync, no study can have
+    been updated and only the window is moved.
+    Without a snapshot or sync state, or when the stages need other fields than the snapshot has,
+    it falls back to a full download.
+    """
+    state = read_sync_state()
+
+    if not cache.exists("last_five_years_data") or state is None or state.get("fields") != snapshot_fields():
+        pipeline.invalidate("last_five_years_data")
+        cache.write_frames("last_five_years_data", download_and_record(workers))
+        pipeline.record("last_five_years_data", params=snapshot_params())
+        return cache.read("last_five_years_data")
 
     ct = ClinicalTrials()
-    start_date = (datetime.now() - timedelta(days=5*365)).strftime('%Y-%m-%d')
-    today = datetime.now().strftime('%Y-%m-%d')
+    api_info = ct.api_info
+    synced_at = datetime.now()
+    # Last update dates only have day precision, so re-fetch the day of the previous sync
+    since = datetime.fromisoformat(state["synced_at"]).strftime('%Y-%m-%d')
+    frames = []
+    if state["data_timestamp"] != api_info[1]:
+        frames.append(download_studies(
+            ct, f"{SEARCH_EXPR} AND AREA[LastUpdatePostDate]RANGE[{since}, MAX]", workers=workers, name="updates"
+        ))
+    # Studies whose start date has entered the window since the last sync weren't necessarily updated
+    window_end = state.get("window_end", since)
+    frames.append(download_studies(ct, f"AREA[StartDate]RANGE[{window_end}, {today}]", workers=workers, name="started"))
+
+    df = pd.concat(
+        [cache.apply_schema(frame, cache.STUDY_SCHEMA) for frame in (*frames, cache.read("last_five_years_data"))],
+        ignore_index=True,
+    )
+    df = df.drop_duplicates(subset="NCT Number", keep="first")
+    # Drop studies that have slid out of the five year window
+    df = df[in_window(df["Start Date"])].reset_index(drop=True)
 
-    last_five_years = ct.get_full_studies(search_expr=SEARCH_EXPR, max_studies=500000, fmt="csv")
-    df = pd.DataFrame.from_records(last_five_years[1:], columns=last_five_years[0])
-    df.to_csv(cache_path, index=False)
+    df = cache.write("last_five_years_data", df)
+    pipeline.record("last_five_years_data", params=snapshot_params())
+    write_sync_state(api_info, synced_at)
 
     return df
 
+def in_window(start_dates):
+    """
+    Returns a boolean mask of the start dates within the five year window. Month precision dates
+    are kept from the month the window starts in, studies without a start date are left out.
+    """
+    dates = compact.to_dates(start_dates)
+    window_start = pd.Timestamp(start_date)
+    month_only = start_dates.astype("string").str.len().eq(7).fillna(False).to_numpy()
+    return ((dates >= window_start) | (month_only & (dates >= window_start.to_period("M").to_timestamp()))).to_numpy()
+
+def download_and_record(workers=8):
+    """
+    Downloads the full five year window, yielding its pages as DataFrames so they can be written
+    as they arrive, and records the sync state for it once every page has been downloaded.
+    """
+    ct = ClinicalTrials()
+    # Resolved first, an update of the registry during the download must not be recorded as synced
+    api_info = ct.api_info
+    synced_at = datetime.now()
+    yield from stream_studies(ct, SEARCH_EXPR, workers=workers)
+    write_sync_state(api_info, synced_at)
+
+def download_studies(ct, search_expr, workers=8, fields=None, name="snapshot"):
+    """
+    Downloads the `fields` (by default `snapshot_fields()`) of all studies matching `search_expr`
+    and returns them as a DataFrame. Meant for small downloads, see `stream_studies`.
+    """
+    return pd.concat(list(stream_studies(ct, search_expr, workers, fields, name)), ignore_index=True)
+
+def stream_studies(ct, search_expr, workers=8, fields=None, name="snapshot"):
+    """
+    Downloads the `fields` (by default `snapshot_fields()`) of all studies matching `search_expr`
+    and yields them page by page as DataFrames, or a single empty one if no study matches.
+
+    The pages are checkpointed in a spool directory under the API cache, so a download that
+    failed resumes from its last page when it's run again. `name` tells the downloads apart: the
+    spool of an earlier, different query of the same name (e.g. the window of another day) can't
+    be resumed and is deleted.
+    """
+    fields = fields or snapshot_fields()
+    spool_dir = spool_root() / name / hashlib.sha256(json.dumps([search_expr, fields, workers]).encode()).hexdigest()[:16]
+    prune_spools(spool_dir)
+    empty = True
+    # Pages are decoded straight into columns, only the page being written is held in memory
+    for page in ct.iter_study_fields(
+        search_expr, fields, max_studies=500000, fmt="frame", workers=workers, spool_dir=spool_dir
+    ):
+        empty = False
+        yield page
+    if empty:
+        yield pd.DataFrame(columns=fields)
+
+def spool_root():
+    return api_cache_root / "spool"
+
+def prune_spools(spool_dir):
+    """Deletes the spools next to `spool_dir`, left by downloads of other queries that failed."""
+    if not spool_dir.parent.exists():
+        return
+    for path in spool_dir.parent.iterdir():
+        if path != spool_dir:
+            shutil.rmtree(path, ignore_errors=True)
+
+def read_sync_state():
+    """
+    Returns the state recorded by the last sync of the five year snapshot, or None.
+    """
+    state_path = api_cache_root / "last_five_years_data.sync.json"
+    if not state_path.exists():
+        return None
+    with open(state_path, 'r') as file:
+        return json.load(file)
+
+def write_sync_state(api_info, synced_at):
+    """
+    Records the time of a sync, the end of the window it covered, and the API version and
+    `dataTimestamp` (the `api_info` read before the download) it was made against.
+    """
+    api_version, data_timestamp = api_info
+    write_to_json(
+        {
+            "synced_at": synced_at.isoformat(),
+            "window_end": today,
+            "data_timestamp": data_timestamp,
+            "api_version": api_version,
+            "search_expr": SEARCH_EXPR,
+            "fields": snapshot_fields(),
+        },
+        api_cache_root / "last_five_years_data.sync.json",
+    )
+
+@instrument()
 def get_conditions():
     """
     Returns a list of conditions. If the conditions are cached, it loads the conditions from the cache.
     Otherwise, it calculates the conditions, caches them, and then returns them.
+    The cache is recomputed whenever the snapshot or the sponsor changes.
     """
-    cache_path = api_cache_root / "conditions.csv"
-
-    if os.path.exists(cache_path):
-        return pd.read_csv(cache_path)["Condition"].tolist()
-
-    df = get_last_five_years_data()
-    Novo_Conditions = df[df["Sponsor"] == "Novo Nordisk A/S"]["Conditions"].unique()
+    return pipeline.load("conditions")["Condition"].tolist()
+
+@pipeline.node(
+    "conditions",
+    deps=["last_five_years_data"],
+    params=lambda: {"sponsor": SPONSOR, "excluded": EXCLUDED_CONDITIONS},
+    fields=["Sponsor", "Conditions"],
+)
+def build_conditions():
+    df = get_last_five_years_data(columns=["Sponsor", "Conditions"])
+    Novo_Conditions = df[df["Sponsor"] == SPONSOR]["Conditions"].unique()
     conditions = [item for sublist in Novo_Conditions for item in sublist.split("|")]
     df_conditions = pd.DataFrame(conditions, columns=["Condition"])
-    df_conditions = df_conditions[~df_conditions["Condition"].isin(["Healthy Participants", "Healthy Volunteers"])]
+    df_conditions = df_conditions[~df_conditions["Condition"].isin(EXCLUDED_CONDITIONS)]
     conditions = df_conditions["Condition"].value_counts()
     conditions = conditions[conditions > 1].index.tolist()
 
-    pd.DataFrame(conditions, columns=["Condition"]).to_csv(cache_path, index=False)
+    return pd.DataFrame(conditions, columns=["Condition"])
+
+@instrument()
+def get_condition_index():
+    """
+    Returns the inverted index from condition terms to the studies of the snapshot. The index is
+    cached next to the snapshot and updated incrementally whenever the snapshot changes.
+    """
+    return ConditionIndex(pipeline.load("condition_index"))
+
+@pipeline.node("condition_index", deps=["last_five_years_data"], fields=["NCT Number", "Conditions"])
+def build_condition_index():
+    previous = cache.read("condition_index") if cache.exists("condition_index") else None
+    df = get_last_five_years_data(columns=["NCT Number", "Conditions"])
 
-    return conditions
+    return ConditionIndex.build(df, previous).table
 
+@instrument()
 def get_competitors():
     """
     Returns a list of competitors. If the competitors are cached, it loads the competitors from the cache.
     Otherwise, it calculates the competitors, caches them, and then returns them.
+    The cache is recomputed whenever the snapshot, the conditions or the sponsor changes.
     """
-    cache_path = api_cache_root / "competitors.csv"
-    if os.path.exists(cache_path):
-        return pd.read_csv(cache_path)["Competitor"].tolist()
-
-    df = get_last_five_years_data()
+    return pipeline.load("competitors")["Competitor"].tolist()
+
+@pipeline.node(
+    "competitors",
+    deps=["last_five_years_data", "conditions", "condition_index"],
+    params=lambda: {"sponsor": SPONSOR, "funder_type": "INDUSTRY", "min_trials": 10},
+    fields=["NCT Number", "Sponsor", "Funder Type"],
+)
+def build_competitors():
+    df = get_last_five_years_data(columns=["NCT Number", "Sponsor", "Funder Type"])
     conditions = get_conditions()
-    df_filtered = df[df["Conditions"].str.contains("|".join(conditions))]
-    df_filtered = df_filtered[df_filtered["Sponsor"] != "Novo Nordisk A/S"]
+    df_filtered = df[get_condition_index().mask(df["NCT Number"], conditions)]
+    df_filtered = df_filtered[df_filtered["Sponsor"] != SPONSOR]
     df_filtered = df_filtered[df_filtered["Funder Type"] == "INDUSTRY"]
     competitors = df_filtered["Sponsor"].value_counts()[df_filtered["Sponsor"].value_counts() > 10].index.tolist()
 
-    pd.DataFrame(competitors, columns=["Competitor"]).to_csv(cache_path, index=False)
-
-    return competitors
+    return pd.DataFrame(competitors, columns=["Competitor"])
 
-def get_competitor_trials():
+@instrument()
+def get_competitor_trials(columns=None):
     """
     Returns a DataFrame of competitor trials. If the DataFrame is cached, it loads the DataFrame from the cache.
     Otherwise, it calculates the DataFrame, caches it, and then returns it.
+    `columns` restricts the returned frame, and what is read from the cache, to those columns.
     """
-    cache_path = api_cache_root / "competitor_trials.csv"
-    if os.path.exists(cache_path):
-        return pd.read_csv(cache_path)
-
-    df = get_last_five_years_data()
+    return pipeline.load("competitor_trials", columns=columns)
+
+@pipeline.node(
+    "competitor_trials",
+    deps=["last_five_years_data", "conditions", "condition_index", "competitors"],
+    fields=COMPETITOR_TRIAL_FIELDS,
+)
+def build_competitor_trials():
+    df = get_last_five_years_data(columns=COMPETITOR_TRIAL_FIELDS)
     studies_by_sponsor = get_studies_by_sponsor(df)
     competitor_trials_df = df[df["NCT Number"].isin([item for sublist in studies_by_sponsor.values() for item in sublist])]
-    competitor_trials_df.reset_index(drop=True, inplace=True)
-
-    competitor_trials_df.to_csv(cache_path, index=False)
 
-    return competitor_trials_df
+    return competitor_trials_df.reset_index(drop=True)
 
+@instrument()
 def get_geographic_data():
-    cache_path = api_cache_root / "geographic_data.csv"
-    if os.path.exists(cache_path):
-        return pd.read_csv(cache_path)
-
+    return pipeline.load("geographic_data")
+
+@pipeline.node(
+    "geographic_data",
+    deps=["competitor_trials"],
+    params=lambda: {"fields": ["NCTId", "LocationCountry"], "country_aliases": get_country_aliases()},
+)
+def build_geographic_data():
     ct = ClinicalTrials()
 
-    # Get the NCTId and LocationCountry fields
-    geographic_locations = ct.get_study_fields(
-        search_expr=f"AREA[StartDate]RANGE[{start_date}, {today}]",
+    competitor_trials_df = get_competitor_trials()
+
+    # Get the NCTId and LocationCountry fields of the competitor trials only
+    geographic_locations = ct.get_studies_by_ids(
+        competitor_trials_df["NCT Number"].tolist(),
         fields=["NCTId","LocationCountry"],
-        max_studies=500000,
         fmt="json",
     )
 
     geo_data_list = list(extract_data(geographic_locations))
 
-    geo_df = pd.DataFrame(geo_data_list)
-
-    competitor_trials_df = get_competitor_trials()
+    geo_df = pd.DataFrame(geo_data_list, columns=["NCT Number", "Country"])
 
-    geo_df = pd.DataFrame(geo_df).merge(competitor_trials_df, on='NCT Number', how='inner')
+    geo_df = geo_df.merge(competitor_trials_df, on='NCT Number', how='inner')
 
     # Add a new column for country code
-    geo_df['Country Code'] = geo_df['Country'].apply(country_to_code)
-
-    geo_df.to_csv(cache_path, index=False)
+    geo_df['Country Code'] = resolve_country_codes(geo_df['Country'])
 
     return geo_df
 
 #####
 
+# (snapshot hash, CompetitorMatrix) of the last snapshot the matrix was built from
+_competitor_matrix = (None, None)
+
+@instrument()
+def get_competitor_matrix():
+    """
+    Returns the sponsor x condition matrices of the snapshot (see `CompetitorMatrix`), with the
+    parameters of the "conditions" and "competitors" artifacts. Built once per snapshot version.
+    """
+    global _competitor_matrix
+
+    # The snapshot is only read when it has changed since the matrices were built
+    version, df = pipeline.ensure("last_five_years_data")
+    if _competitor_matrix[0] != version:
+        columns = ["Sponsor", "Conditions", "Funder Type"]
+        df = cache.read("last_five_years_data", columns=columns) if df is None else df[columns]
+        _competitor_matrix = (version, CompetitorMatrix(df, excluded=EXCLUDED_CONDITIONS, funder_type="INDUSTRY"))
+    return _competitor_matrix[1]
+
+def find_competitors(sponsors):
+    """
+    Returns the competitors of each of `sponsors` as {sponsor: [competitor, ...]}, or the list of
+    competitors of a single sponsor. Any number of sponsors costs about as much as one.
+    """
+    return get_competitor_matrix().competitors(sponsors)
+
+@instrument(rows_in="df")
 def get_studies_by_sponsor(df):
     """
     Returns a dictionary of the NCT Number of the studies by sponsor.
@@ -133,7 +362,7 @@ def get_studies_by_sponsor(df):
     conditions = get_conditions()
     competitors = get_competitors()
     df_competitors = df[df["Sponsor"].isin(competitors)]
-    df_competitors = df_competitors[df_competitors["Conditions"].str.contains('|'.join(conditions))]
+    df_competitors = df_competitors[get_condition_index().mask(df_competitors["NCT Number"], conditions)]
     studies_by_sponsor = df_competitors.groupby("Sponsor")["NCT Number"].apply(list).to_dict()
 
     return studies_by_sponsor
@@ -151,18 +380,26 @@ def map_conditions(df, column, json_path):
 
     return df
 
-def get_competitor_trials_one_cond(json_path="cached_data/condition_groups.json"):
+@instrument(rows_in="competitor_trials_df")
+def get_competitor_trials_one_cond(json_path="cached_data/condition_groups.json", competitor_trials_df=None, conditions=None):
     """
     Processes the competitor trials DataFrame by splitting and exploding the "Conditions" column,
     filtering the DataFrame for the specified conditions, and mapping the conditions to their groups.
+    Already loaded competitor trials and conditions can be passed in to avoid loading them again.
     """
-    conditions = get_conditions()
-    competitor_trials_df = get_competitor_trials()
+    if conditions is None:
+        conditions = get_conditions()
     # Select the necessary columns
-    competitor_trials_one_cond = competitor_trials_df[["NCT Number","Sponsor", "Conditions"]]
-
-    # Split the "Conditions" column by "|" and create a new row for each string in the split
-    competitor_trials_one_cond['Condition'] = competitor_trials_one_cond['Conditions'].str.split('|')
+    if competitor_trials_df is None:
+        competitor_trials_one_cond = get_competitor_trials(columns=["NCT Number","Sponsor", "Conditions"])
+    else:
+        competitor_trials_one_cond = competitor_trials_df[["NCT Number","Sponsor", "Conditions"]].copy()
+
+    # Split the "Conditions" column by "|" (unless it's already split) and create a new row for each string in the split
+    if compact.is_split(competitor_trials_one_cond['Conditions']):
+        competitor_trials_one_cond['Condition'] = competitor_trials_one_cond['Conditions']
+    else:
+        competitor_trials_one_cond['Condition'] = competitor_trials_one_cond['Conditions'].str.split('|')
     competitor_trials_one_cond = competitor_trials_one_cond.explode('Condition')
 
     # Filter competitor_trials_one_cond for conditions in the list conditions
@@ -174,6 +411,7 @@ def get_competitor_trials_one_cond(json_path="cached_data/condition_groups.json"
     return competitor_trials_one_cond
 
 def write_to_json(data, filename):
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
     with open(filename, 'w') as f:
         json.dump(data, f)
 
@@ -189,7 +427,77 @@ def extract_data(geographic_locations):
 
 # Function to convert country name to country code
 def country_to_code(country_name):
+    # Imported here, loading pycountry's databases is slow and only needed for unseen names
+    import pycountry
+
     try:
         return pycountry.countries.lookup(country_name).alpha_3
-    except:
+    except LookupError:
         return None
+
+# Registry country names that pycountry doesn't resolve (or resolves differently)
+COUNTRY_ALIASES = {
+    "Burma": "MMR",
+    "Cape Verde": "CPV",
+    "Kosovo": "XKX",
+    "Libyan Arab Jamahiriya": "LBY",
+    "Macau": "MAC",
+    "Macedonia, The Former Yugoslav Republic of": "MKD",
+    "Palestinian Territories": "PSE",
+    "Palestinian Territory, occupied": "PSE",
+    "Reunion": "REU",
+    "Saint Martin": "MAF",
+    "Swaziland": "SWZ",
+    "Turkey": "TUR",
+    "Virgin Islands (U.S.)": "VIR",
+}
+
+@instrument()
+def get_country_aliases(aliases_path=api_cache_root.parent / "country_aliases.json"):
+    """
+    Returns the country name aliases: COUNTRY_ALIASES extended (or overridden) by the optional
+    JSON file at `aliases_path`.
+    """
+    aliases = dict(COUNTRY_ALIASES)
+    if os.path.exists(aliases_path):
+        with open(aliases_path, 'r') as file:
+            aliases.update(json.load(file))
+    return aliases
+
+def read_country_table():
+    """
+    Returns the persisted resolution table, {"resolved": {name: ISO-3 code}, "unresolved": [names]}.
+    """
+    table_path = api_cache_root / "country_codes.json"
+    if not table_path.exists():
+        return {"resolved": {}, "unresolved": []}
+    with open(table_path, 'r') as file:
+        return json.load(file)
+
+def resolve_country_codes(countries):
+    """
+    Maps a Series of country names to ISO-3 codes, None for names that can't be resolved.
+
+    Each distinct name is looked up once: aliases first, then the persisted resolution table, then
+    pycountry for names never seen before. New names are added to the table, names pycountry can't
+    resolve are recorded as unresolved so they are not looked up again.
+    """
+    names = countries.astype("category")
+    aliases = get_country_aliases()
+    table = read_country_table()
+    resolved, unresolved = table["resolved"], set(table["unresolved"])
+
+    new_names = [name for name in names.cat.categories
+                 if name not in aliases and name not in resolved and name not in unresolved]
+    for name in new_names:
+        code = country_to_code(name)
+        if code is None:
+            unresolved.add(name)
+        else:
+            resolved[name] = code
+    if new_names:
+        write_to_json({"resolved": resolved, "unresolved": sorted(unresolved)}, api_cache_root / "country_codes.json")
+
+    # One code per category, plus a trailing None for missing names (category code -1)
+    codes = [aliases.get(name, resolved.get(name)) for name in names.cat.categories] + [None]
+    return pd.Series(np.array(codes, dtype=object)[names.cat.codes.to_numpy()], index=countries.index)
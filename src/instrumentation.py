@@ -0,0 +1,276 @@
+"""
+Spans timing the stages of the pipeline, from HTTP requests to figure building.
+
+Disabled by default, in which case `span` hands out a shared no-op and `instrument` calls straight
+through. Enable it with `enable()` or the DE_CASE_INSTRUMENTATION=1 environment variable:
+
+- DE_CASE_INSTRUMENTATION_LOG: file to append every finished span to, as one JSON object per line.
+- DE_CASE_INSTRUMENTATION_MEMORY=1: trace allocations to report the peak memory of every span.
+  Tracing slows the pipeline down noticeably, the resident memory delta is always reported. The peak
+  is process wide, spans running concurrently in other threads count towards it.
+
+Finished spans are aggregated per name (count, wall time histogram, rows, bytes, pages, peak memory)
+and `prometheus_text` renders the aggregates, and the values registered with `gauge`, in the
+Prometheus text format.
+"""
+from bisect import bisect_left
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+# Upper bounds of the wall time histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Counters a span can accumulate, summed per span name
+COUNTERS = ("rows_in", "rows_out", "bytes", "pages")
+
+
+class _State:
+    enabled = False
+    memory = False
+    log_path = None
+
+
+_state = _State()
+_lock = threading.Lock()
+_local = threading.local()
+# Span name -> aggregate
+_metrics = {}
+# Metric name -> (type, description, function returning its current value)
+_gauges = {}
+
+
+class _NoopSpan:
+    """Stands in for a span when instrumentation is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add(self, **counters):
+        pass
+
+    def set(self, **attributes):
+        pass
+
+
+NOOP = _NoopSpan()
+
+
+class Span:
+    """A timed section of work, with counters and attributes. Use it through `span`."""
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.counters = {}
+        self.parent = None
+
+    def add(self, **counters):
+        """Adds to the counters of the span, e.g. ``span.add(rows_out=len(df), pages=1)``."""
+        for counter, value in counters.items():
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        stack = _stack()
+        self.parent = stack[-1] if stack else None
+        stack.append(self)
+        self.rss_start = _rss()
+        if _state.memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if self.parent is not None:
+                self.parent.peak_seen = max(getattr(self.parent, "peak_seen", 0), peak)
+            tracemalloc.reset_peak()
+            self.memory_start, self.peak_seen = current, current
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.seconds = time.perf_counter() - self.start
+        _stack().pop()
+        record = {
+            "span": self.name,
+            "parent": self.parent.name if self.parent else None,
+            "start": self.started_at,
+            "seconds": self.seconds,
+            "thread": threading.current_thread().name,
+            **self.counters,
+        }
+        if self.attributes:
+            record["attributes"] = self.attributes
+        rss_end = _rss()
+        if rss_end is not None and self.rss_start is not None:
+            record["rss_delta_bytes"] = rss_end - self.rss_start
+        if hasattr(self, "memory_start") and tracemalloc.is_tracing():
+            peak = max(self.peak_seen, tracemalloc.get_traced_memory()[1])
+            record["peak_memory_delta_bytes"] = peak - self.memory_start
+            if self.parent is not None and hasattr(self.parent, "peak_seen"):
+                self.parent.peak_seen = max(self.parent.peak_seen, peak)
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        _finish(record)
+        return False
+
+
+def enable(log_path=None, memory=False):
+    """Turns instrumentation on, appending spans to `log_path` if given and tracing allocations with `memory`."""
+    _state.log_path = log_path
+    _state.memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _state.enabled = True
+
+def disable():
+    _state.enabled = False
+    if _state.memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _state.memory = False
+
+def is_enabled():
+    return _state.enabled
+
+def span(name, **attributes):
+    """
+    Returns a context manager timing the enclosed block as span `name`. It yields the span, whose
+    `add` accumulates counters (rows_in, rows_out, bytes, pages) and `set` attributes.
+    """
+    if not _state.enabled:
+        return NOOP
+    return Span(name, attributes)
+
+def instrument(name=None, rows_in=None):
+    """
+    Decorates a function so every call is a span, named after the function by default. The length
+    of the returned value, when it has one, is recorded as rows_out, and the length of the argument
+    named `rows_in`, when it's passed, as rows_in.
+    """
+    def decorator(func):
+        span_name = name or f"{func.__module__}.{func.__qualname__}"
+        signature = inspect.signature(func) if rows_in else None
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _state.enabled:
+                return func(*args, **kwargs)
+            with Span(span_name, {}) as current:
+                if signature is not None:
+                    value = signature.bind_partial(*args, **kwargs).arguments.get(rows_in)
+                    if value is not None:
+                        current.add(rows_in=len(value))
+                result = func(*args, **kwargs)
+                try:
+                    current.add(rows_out=len(result))
+                except TypeError:
+                    pass
+                return result
+        return wrapper
+    return decorator
+
+def gauge(name, description, read, kind="gauge"):
+    """
+    Registers a value exported with the span aggregates, read by calling `read` whenever the metrics
+    are rendered. `kind` is its Prometheus type, "gauge" or "counter".
+    """
+    with _lock:
+        _gauges[name] = (kind, description, read)
+
+def metrics():
+    """Returns a copy of the aggregates of the finished spans, by span name."""
+    with _lock:
+        return {name: {**aggregate, "buckets": list(aggregate["buckets"])} for name, aggregate in _metrics.items()}
+
+def reset():
+    with _lock:
+        _metrics.clear()
+
+def prometheus_text():
+    """Renders the span aggregates in the Prometheus text exposition format."""
+    lines = [
+        "# HELP de_case_span_seconds Wall time of the instrumented spans.",
+        "# TYPE de_case_span_seconds histogram",
+    ]
+    aggregates = metrics()
+    for name, aggregate in sorted(aggregates.items()):
+        label = _label(name)
+        cumulative = 0
+        for bound, count in zip(BUCKETS, aggregate["buckets"]):
+            cumulative += count
+            lines.append(f'de_case_span_seconds_bucket{{span="{label}",le="{bound}"}} {cumulative}')
+        lines.append(f'de_case_span_seconds_bucket{{span="{label}",le="+Inf"}} {aggregate["count"]}')
+        lines.append(f'de_case_span_seconds_sum{{span="{label}"}} {aggregate["seconds"]}')
+        lines.append(f'de_case_span_seconds_count{{span="{label}"}} {aggregate["count"]}')
+    for counter in COUNTERS:
+        lines.append(f"# HELP de_case_span_{counter}_total Total {counter.replace('_', ' ')} of the instrumented spans.")
+        lines.append(f"# TYPE de_case_span_{counter}_total counter")
+        for name, aggregate in sorted(aggregates.items()):
+            if counter in aggregate:
+                lines.append(f'de_case_span_{counter}_total{{span="{_label(name)}"}} {aggregate[counter]}')
+    lines.append("# HELP de_case_span_errors_total Spans that ended with an exception.")
+    lines.append("# TYPE de_case_span_errors_total counter")
+    for name, aggregate in sorted(aggregates.items()):
+        lines.append(f'de_case_span_errors_total{{span="{_label(name)}"}} {aggregate["errors"]}')
+    lines.append("# HELP de_case_span_peak_memory_delta_bytes Largest peak memory delta of a span.")
+    lines.append("# TYPE de_case_span_peak_memory_delta_bytes gauge")
+    for name, aggregate in sorted(aggregates.items()):
+        if "peak_memory_delta_bytes" in aggregate:
+            lines.append(f'de_case_span_peak_memory_delta_bytes{{span="{_label(name)}"}} {aggregate["peak_memory_delta_bytes"]}')
+    with _lock:
+        gauges = sorted(_gauges.items())
+    for name, (kind, description, read) in gauges:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {read()}")
+    return "\n".join(lines) + "\n"
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _stack():
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+def _rss():
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+def _finish(record):
+    with _lock:
+        aggregate = _metrics.get(record["span"])
+        if aggregate is None:
+            aggregate = _metrics[record["span"]] = {"count": 0, "seconds": 0.0, "errors": 0, "buckets": [0] * len(BUCKETS)}
+        aggregate["count"] += 1
+        aggregate["seconds"] += record["seconds"]
+        aggregate["errors"] += "error" in record
+        bucket = bisect_left(BUCKETS, record["seconds"])
+        if bucket < len(BUCKETS):
+            aggregate["buckets"][bucket] += 1
+        for counter in COUNTERS:
+            if counter in record:
+                aggregate[counter] = aggregate.get(counter, 0) + record[counter]
+        if "peak_memory_delta_bytes" in record:
+            aggregate["peak_memory_delta_bytes"] = max(aggregate.get("peak_memory_delta_bytes", 0), record["peak_memory_delta_bytes"])
+        if _state.log_path:
+            with open(_state.log_path, "a") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+
+
+if os.environ.get("DE_CASE_INSTRUMENTATION") == "1":
+    enable(
+        log_path=os.environ.get("DE_CASE_INSTRUMENTATION_LOG"),
+        memory=os.environ.get("DE_CASE_INSTRUMENTATION_MEMORY") == "1",
+    )
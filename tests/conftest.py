@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# The cache root is read when src.data_processing is imported, keep the tests away from the real cache
+os.environ.setdefault("DE_CASE_CACHE_ROOT", os.path.join(tempfile.mkdtemp(prefix="de_case_tests_"), "api_extracts"))
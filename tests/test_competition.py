@@ -0,0 +1,45 @@
+import pytest
+
+from benchmarks.synthetic import make_studies
+from src.data_processing import cache, pipeline, utils
+from src.data_processing.competition import CompetitorMatrix
+
+
+@pytest.fixture(scope="module")
+def snapshot():
+    df = make_studies(20_000, seed=2)
+    cache.write("last_five_years_data", df)
+    pipeline.record("last_five_years_data", params=utils.snapshot_params())
+    return df
+
+
+def brute_force_competitors(df, sponsor, conditions):
+    df = df.dropna(subset=["Conditions"])
+    in_area = df["Conditions"].str.split("|").apply(lambda listed: any(c in conditions for c in listed))
+    counts = df[in_area & (df["Sponsor"] != sponsor) & (df["Funder Type"] == "INDUSTRY")]["Sponsor"].value_counts()
+    return set(counts[counts > 10].index)
+
+
+def test_matches_the_pipeline_artifacts(snapshot):
+    matrix = utils.get_competitor_matrix()
+    competitors = utils.get_competitors()
+
+    assert set(matrix.conditions_of(utils.SPONSOR)) == set(utils.get_conditions())
+    assert competitors
+    assert set(utils.find_competitors(utils.SPONSOR)) == set(competitors)
+
+
+def test_several_sponsors_at_once(snapshot):
+    matrix = CompetitorMatrix(snapshot, excluded=utils.EXCLUDED_CONDITIONS)
+    sponsors = [utils.SPONSOR] + [sponsor for sponsor in matrix.sponsors if sponsor.startswith("Pharma")][:10]
+    found = matrix.competitors(sponsors)
+
+    assert list(found) == sponsors
+    for sponsor in sponsors:
+        assert found[sponsor] == matrix.competitors(sponsor)
+        assert set(found[sponsor]) == brute_force_competitors(snapshot, sponsor, set(matrix.conditions_of(sponsor)))
+
+
+def test_unknown_sponsor(snapshot):
+    with pytest.raises(KeyError):
+        CompetitorMatrix(snapshot).competitors(["Nobody"])
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data_processing.indexes import ConditionIndex, TrialIndex
+
+
+def studies():
+    return pd.DataFrame({
+        "NCT Number": ["NCT1", "NCT2", "NCT3", "NCT4"],
+        "Conditions": ["Obesity|Diabetes", "Diabetes", None, "Asthma|Obesity"],
+    })
+
+
+def test_condition_postings():
+    index = ConditionIndex.build(studies())
+    assert set(index.nct_numbers(["Diabetes"])) == {"NCT1", "NCT2"}
+    assert set(index.nct_numbers(["Obesity", "Asthma"])) == {"NCT1", "NCT4"}
+    assert len(index.nct_numbers(["Unknown"])) == 0
+
+
+def test_mask_and_positions():
+    index = ConditionIndex.build(studies())
+    nct_numbers = ["NCT4", "NCT3", "NCT2"]
+    assert index.mask(nct_numbers, ["Obesity"]).tolist() == [True, False, False]
+    assert index.positions(nct_numbers, ["Diabetes", "Asthma"]).tolist() == [0, 2]
+
+
+def test_incremental_build_matches_a_full_build():
+    previous = ConditionIndex.build(studies()).table
+    changed = studies()
+    changed.loc[1, "Conditions"] = "Hypertension"
+    changed = pd.concat([changed.drop(index=3), pd.DataFrame({"NCT Number": ["NCT5"], "Conditions": ["Asthma"]})])
+
+    incremental = ConditionIndex.build(changed, previous)
+    full = ConditionIndex.build(changed)
+    for conditions in (["Obesity"], ["Diabetes"], ["Hypertension"], ["Asthma"]):
+        assert np.array_equal(np.sort(incremental.nct_numbers(conditions)), np.sort(full.nct_numbers(conditions)))
+    # Only the studies still in the snapshot are indexed
+    assert set(incremental.table["NCT Number"]) == {"NCT1", "NCT2", "NCT5"}
+
+
+def trials():
+    return pd.DataFrame({
+        "NCT Number": ["NCT1", "NCT2", "NCT3", "NCT4"],
+        "Sponsor": ["A", "B", "A", "C"],
+        "Funder Type": ["INDUSTRY", "INDUSTRY", "OTHER", "INDUSTRY"],
+        "Phases": ["PHASE3", "PHASE2", "PHASE3", None],
+        "Start Date": ["2022-05-01", "2023-01", "2023-07-15", None],
+    })
+
+
+def test_trial_filters_match_a_scan():
+    df = trials()
+    index = TrialIndex(df)
+    expected = df[df["Sponsor"].isin(["A", "C"]) & (df["Funder Type"] == "INDUSTRY")].index
+    assert index.select(sponsor=["A", "C"], funder_type="INDUSTRY").tolist() == expected.tolist()
+    assert index.rows(phases="PHASE3", start_year=2023)["NCT Number"].tolist() == ["NCT3"]
+    assert index.count() == 4
+    assert index.count(sponsor="Unknown") == 0
+
+
+def test_trial_filter_without_accepted_values():
+    assert TrialIndex(trials()).count(sponsor=[]) == 0
+
+
+def test_trial_groups_and_counts():
+    groups = pd.DataFrame({
+        "NCT Number": ["NCT1", "NCT1", "NCT2", "NCT9"],
+        "Group": ["Obesity", "Diabetes", "Diabetes", "Asthma"],
+    })
+    index = TrialIndex(trials(), groups=groups)
+    assert "group" in index.dimensions
+    # Trials outside of the index are ignored
+    assert index.values("group") == ["Diabetes", "Obesity"]
+    assert index.counts("group", sponsor="A").to_dict() == {"Diabetes": 1, "Obesity": 1}
+    assert index.counts("sponsor").to_dict() == {"A": 2, "B": 1, "C": 1}
+
+
+def test_trial_unknown_dimension():
+    with pytest.raises(KeyError):
+        TrialIndex(trials()).select(country="DK")
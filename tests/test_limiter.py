@@ -0,0 +1,85 @@
+import threading
+import time
+
+from src.api_client.limiter import AdaptiveLimiter, parse_retry_after
+
+
+def take_within(limiter, timeout):
+    thread = threading.Thread(target=limiter.take, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return not thread.is_alive()
+
+
+def test_rate_below_one_lets_requests_through():
+    limiter = AdaptiveLimiter(rate=0.5)
+    assert take_within(limiter, 1.0)
+    # The next token takes 2s to refill
+    assert not take_within(limiter, 0.5)
+
+
+def test_bucket_refills_at_the_rate():
+    limiter = AdaptiveLimiter(rate=20.0)
+    start = time.monotonic()
+    for _ in range(20):
+        limiter.take()
+    assert time.monotonic() - start < 0.1
+    limiter.take()
+    limiter.take()
+    assert time.monotonic() - start >= 0.05
+
+
+def test_throttle_backs_off_and_pauses():
+    limiter = AdaptiveLimiter(rate=8.0, concurrency=8)
+    limiter.throttled(retry_after=0.3)
+    stats = limiter.stats()
+    assert stats["rate"] == 4.0
+    assert stats["limit"] == 4
+    assert stats["throttled"] == 1
+    start = time.monotonic()
+    limiter.take()
+    assert time.monotonic() - start >= 0.25
+
+
+def test_rate_never_drops_below_the_minimum():
+    limiter = AdaptiveLimiter(rate=2.0)
+    for _ in range(5):
+        limiter.throttled(retry_after=0)
+    assert limiter.stats()["rate"] == 1.0
+
+
+def test_limits_only_ramp_up_while_bound():
+    limiter = AdaptiveLimiter(rate=1.0, rate_step=0.5, concurrency=1)
+    for _ in range(3):
+        limiter.succeeded()
+    assert limiter.stats()["rate"] == 1.0
+    assert limiter.stats()["limit"] == 1
+
+    limiter.take()
+    # The bucket is empty, the next request is held back by the rate
+    assert not take_within(limiter, 0.2)
+    limiter.succeeded()
+    assert limiter.stats()["rate"] == 1.5
+
+
+def test_slot_caps_concurrency():
+    limiter = AdaptiveLimiter(concurrency=1)
+    entered = threading.Event()
+
+    def hold():
+        with limiter.slot():
+            entered.set()
+
+    with limiter.slot():
+        thread = threading.Thread(target=hold, daemon=True)
+        thread.start()
+        assert not entered.wait(0.2)
+        assert limiter.stats()["queue_depth"] == 1
+    assert entered.wait(1.0)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("") is None
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
@@ -0,0 +1,91 @@
+import io
+from types import SimpleNamespace
+
+import pytest
+
+from src.api_client import response_cache
+from src.api_client.response_cache import ResponseCache, TeeStream, replay
+
+URL = "https://clinicaltrials.gov/api/v2/studies?query.term=diabetes&pageSize=10"
+VERSION_URL = "https://clinicaltrials.gov/api/v2/version"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A clock that only moves when told to, one second per call otherwise."""
+    now = [1_000_000.0]
+
+    def time():
+        now[0] += 1
+        return now[0]
+
+    monkeypatch.setattr(response_cache.time, "time", time)
+    return now
+
+
+def test_round_trip(tmp_path):
+    cache = ResponseCache(tmp_path)
+    cache.put(URL, 200, {"Content-Type": "application/json"}, b'{"studies": []}', data_timestamp="2026-10-01")
+
+    # Same URL with its parameters in another order
+    same = "https://CLINICALTRIALS.gov/api/v2/studies?pageSize=10&query.term=diabetes"
+    assert cache.get(same, "2026-10-01") == (200, {"Content-Type": "application/json"}, b'{"studies": []}')
+    assert cache.get(URL.replace("diabetes", "asthma"), "2026-10-01") is None
+    assert cache.stats() == {"entries": 1, "bytes": 15, "hits": 1, "misses": 1}
+
+
+def test_outdated_data_timestamp_is_a_miss(tmp_path):
+    cache = ResponseCache(tmp_path)
+    cache.put(URL, 200, {}, b"body", data_timestamp="2026-10-01")
+    assert cache.get(URL, "2026-10-02") is None
+    # Served until its TTL when the registry can't be reached
+    assert cache.get(URL, None) is not None
+
+
+def test_ttl(tmp_path, clock):
+    cache = ResponseCache(tmp_path, ttl=3600, version_ttl=60)
+    cache.put(URL, 200, {}, b"body")
+    cache.put(VERSION_URL, 200, {}, b"{}")
+
+    clock[0] += 120
+    assert cache.get(URL) is not None
+    assert cache.get(VERSION_URL) is None
+    clock[0] += 3600
+    assert cache.get(URL) is None
+
+
+def test_least_recently_used_are_evicted(tmp_path, clock):
+    cache = ResponseCache(tmp_path, max_bytes=25)
+    for term in ("a", "b", "c"):
+        cache.put(f"{URL}&filter={term}", 200, {}, b"0123456789")
+    assert cache.stats()["entries"] == 2
+    assert cache.get(f"{URL}&filter=a") is None
+
+    # Reading b makes c the least recently used
+    assert cache.get(f"{URL}&filter=b") is not None
+    cache.put(f"{URL}&filter=d", 200, {}, b"0123456789")
+    assert cache.get(f"{URL}&filter=c") is None
+    assert cache.get(f"{URL}&filter=b") is not None
+    assert not cache.body_path(cache.key(f"{URL}&filter=c")).exists()
+
+
+def tee(cache, body):
+    fetched = SimpleNamespace(raw=io.BytesIO(body), close=lambda: None)
+    return replay(URL, 200, {}, TeeStream(fetched, cache.writer(URL, 200, {})))
+
+
+def test_streamed_body_is_cached_once_read(tmp_path):
+    cache = ResponseCache(tmp_path)
+    body = b"x" * 100_000
+    with tee(cache, body) as response:
+        assert response.content == body
+    assert cache.get(URL)[2] == body
+
+
+def test_body_closed_early_is_not_cached(tmp_path):
+    cache = ResponseCache(tmp_path)
+    with tee(cache, b"x" * 100_000) as response:
+        response.raw.read(10)
+    assert cache.get(URL) is None
+    assert cache.stats()["entries"] == 0
+    assert not any(path.is_file() for path in (tmp_path / "bodies").rglob("*"))
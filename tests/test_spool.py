@@ -0,0 +1,52 @@
+import pytest
+
+from src.api_client.spool import PullSpool
+
+
+PARAMS = {"search_expr": "AREA[LeadSponsorName]Acme", "fields": ["NCTId"]}
+
+
+def test_cursor_resumes_after_reopening(tmp_path):
+    spool = PullSpool(tmp_path, PARAMS).cursor("query")
+    spool.append(["page 1"], "token-2")
+    spool.append(["page 2"], "token-3")
+
+    resumed = PullSpool(tmp_path, PARAMS).cursor("query")
+    assert list(resumed.pages()) == [["page 1"], ["page 2"]]
+    assert resumed.next_token == "token-3"
+    assert not resumed.done
+
+    resumed.append(["page 3"], None)
+    assert PullSpool(tmp_path, PARAMS).cursor("query").done
+
+
+def test_cursors_are_spooled_separately(tmp_path):
+    pull = PullSpool(tmp_path, PARAMS)
+    pull.cursor("shard 1").append(["a"], None)
+    assert list(pull.cursor("shard 2").pages()) == []
+
+
+def test_other_parameters_are_rejected(tmp_path):
+    PullSpool(tmp_path, PARAMS)
+    with pytest.raises(ValueError):
+        PullSpool(tmp_path, {**PARAMS, "fields": ["NCTId", "Phase"]})
+
+
+def test_reset_pages_the_cursor_again(tmp_path):
+    spool = PullSpool(tmp_path, PARAMS).cursor("query")
+    spool.append(["page 1"], "expired")
+    spool.reset()
+
+    resumed = PullSpool(tmp_path, PARAMS).cursor("query")
+    assert list(resumed.pages()) == []
+    assert resumed.next_token is None
+    assert not resumed.done
+
+
+def test_clear_removes_the_spool(tmp_path):
+    pull = PullSpool(tmp_path / "pull", PARAMS)
+    pull.cursor("query").append(["page 1"], None)
+    pull.clear()
+    assert not (tmp_path / "pull").exists()
+    # A fresh pull can then use other parameters
+    PullSpool(tmp_path / "pull", {**PARAMS, "fields": []})
@@ -1,52 +1,63 @@
 import pandas as pd
 import plotly.graph_objects as go
-from src.data_processing.utils import get_competitor_trials, get_competitor_trials_one_cond
+from src.data_processing.aggregations import active_years
+from src.data_processing.context import get_competitor_trials, get_competitor_trials_one_cond
+from src.instrumentation import instrument
 
 def prepare_data():
     """
     Prepare the data for plotting.
     """
-    competitor_trials_df = get_competitor_trials()
+    competitor_trials_df = get_competitor_trials(columns=["NCT Number", "Start Date", "Completion Date", "Sponsor", "Enrollment"])
     competitor_trials_one_cond = get_competitor_trials_one_cond()
     sorted_sponsors = sorted(competitor_trials_df['Sponsor'].unique())
     bar_df = competitor_trials_df[["NCT Number", "Start Date", "Completion Date", "Sponsor", "Enrollment"]].copy()
     bar_df = pd.merge(bar_df, competitor_trials_one_cond[["NCT Number", "Group"]], on="NCT Number", how="inner")
     bar_df['Enrollment'] = bar_df['Enrollment'].astype(int)
-    bar_df['Year'] = bar_df['Start Date'].str[:4].astype(int)
-    bar_df['Completion Year'] = bar_df['Completion Date'].str[:4].astype(int)
-    bar_df = bar_df.dropna(subset=['Year', 'Completion Year'])
+    bar_df['Year'] = bar_df['Start Date'].dt.year
+    bar_df['Completion Year'] = bar_df['Completion Date'].dt.year
+    bar_df = bar_df.dropna(subset=['Year', 'Completion Year']).astype({'Year': int, 'Completion Year': int})
     return bar_df, sorted_sponsors
 
 def expand_data(bar_df):
     """
-    Expand the data to include a row for each year that a study is active.
+    Sum the enrollment of the studies active in each year, per group and sponsor.
     """
-    expanded_df = pd.DataFrame([(group, year, sponsor, enrollment)
-                                for _, row in bar_df.iterrows()
-                                for group in [row['Group']]
-                                for year in range(row['Year'], row['Completion Year'] + 1)
-                                for sponsor in [row['Sponsor']]
-                                for enrollment in [row['Enrollment']]],
-                               columns=['Group', 'Year', 'Sponsor', 'Enrollment'])
-    grouped_df = expanded_df.groupby(['Group', 'Year', 'Sponsor'])['Enrollment'].sum().reset_index()
+    grouped_df = active_years(bar_df, 'Year', 'Completion Year', by=['Group', 'Sponsor'], value_col='Enrollment')
+    grouped_df = grouped_df[['Group', 'Year', 'Sponsor', 'Enrollment']].sort_values(['Group', 'Year', 'Sponsor'], ignore_index=True)
     return grouped_df
 
-def create_plot(grouped_df, sorted_sponsors):
+def create_traces(grouped_df, sponsor, visible=True):
+    """
+    Create the stacked bars of one sponsor, one trace per group.
+    """
+    df = grouped_df[grouped_df['Sponsor'] == sponsor]
+    return [go.Bar(x=df[df['Group'] == group]['Year'],
+                   y=df[df['Group'] == group]['Enrollment'],
+                   name=group,
+                   visible=visible)
+            for group in df['Group'].unique()]
+
+def create_plot(grouped_df, sorted_sponsors, sponsor=None):
     """
     Create a stacked bar chart for each sponsor.
+    With a `sponsor` only the chart of that sponsor is created, without the dropdown.
     """
     fig = go.Figure()
     buttons = []
-    for sponsor in sorted(grouped_df['Sponsor'].unique()):
-        df = grouped_df[grouped_df['Sponsor'] == sponsor]
-        for group in df['Group'].unique():
-            fig.add_trace(go.Bar(x=df[df['Group'] == group]['Year'], 
-                                 y=df[df['Group'] == group]['Enrollment'], 
-                                 name=group,
-                                 visible=(sponsor == sorted_sponsors[0])))
-        buttons.append(dict(method='update',
-                            label=sponsor,
-                            args=[{'visible': [sponsor == s for s in sorted_sponsors]}]))
+    if sponsor is not None:
+        fig.add_traces(create_traces(grouped_df, sponsor))
+    else:
+        traces_sponsors = []
+        for name in sorted(grouped_df['Sponsor'].unique()):
+            traces = create_traces(grouped_df, name, visible=(name == sorted_sponsors[0]))
+            fig.add_traces(traces)
+            traces_sponsors += [name] * len(traces)
+        for name in sorted(grouped_df['Sponsor'].unique()):
+            # One flag per trace, each sponsor has a trace per group
+            buttons.append(dict(method='update',
+                                label=name,
+                                args=[{'visible': [name == s for s in traces_sponsors]}]))
     min_start_date = grouped_df['Year'].min()
     max_completion_date = grouped_df['Year'].max()
     years = list(range(min_start_date, max_completion_date + 1))
@@ -59,7 +70,7 @@ def create_plot(grouped_df, sorted_sponsors):
             tickvals=years,
             ticktext=years
         ),
-        updatemenus=[
+        updatemenus=[] if not buttons else [
             dict(
                 buttons=buttons,
                 direction="down",
@@ -76,13 +87,22 @@ def create_plot(grouped_df, sorted_sponsors):
     return fig
 
 
-def main():
+def sponsors():
+    """
+    Return the sponsors that can be selected, in the order of the dropdown.
+    """
+    bar_df, _ = prepare_data()
+    return sorted(expand_data(bar_df)['Sponsor'].unique())
+
+@instrument()
+def main(sponsor=None):
     """
     Main function to prepare data, expand data and create plot.
+    With a `sponsor` only the chart of that sponsor is created, without the dropdown.
     """
     bar_df, sorted_sponsors = prepare_data()
     grouped_df = expand_data(bar_df)
-    fig = create_plot(grouped_df, sorted_sponsors)  # Store the figure returned by create_plot
+    fig = create_plot(grouped_df, sorted_sponsors, sponsor=sponsor)  # Store the figure returned by create_plot
     return fig  # Return the figure
 
 if __name__ == "__main__":
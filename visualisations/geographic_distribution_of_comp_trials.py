@@ -1,9 +1,6 @@
-import pandas as pd
-from datetime import datetime, timedelta
-from src.api_client.client import ClinicalTrials
 import plotly.graph_objects as go
-import pycountry
-from src.data_processing.utils import get_geographic_data
+from src.data_processing.context import get_geographic_data
+from src.instrumentation import instrument
 
 def prepare_data():
     """
@@ -20,30 +17,38 @@ def create_dropdown(count_df):
     dropdown = [{'label': sponsor, 'method': 'update', 'args': [{'visible': [sponsor == s for s in count_df['Sponsor'].unique()]}]} for sponsor in count_df['Sponsor'].unique()]
     return dropdown
 
+def create_trace(count_df, sponsor, visible=True):
+    """
+    Create the trace of one sponsor.
+    """
+    return go.Choropleth(
+        locations=count_df.loc[count_df['Sponsor'] == sponsor, 'Country Code'],
+        z=count_df.loc[count_df['Sponsor'] == sponsor, 'Count'],
+        name=sponsor,
+        visible=visible,
+        colorscale='Blues'  # Change color gradient to light blue to dark
+    )
+
 def create_traces(count_df):
     """
     Add one trace for each sponsor.
     """
     traces = []
     for sponsor in count_df['Sponsor'].unique():
-        traces.append(
-            go.Choropleth(
-                locations=count_df.loc[count_df['Sponsor'] == sponsor, 'Country Code'],
-                z=count_df.loc[count_df['Sponsor'] == sponsor, 'Count'],
-                name=sponsor,
-                visible=(sponsor == count_df['Sponsor'].unique()[0]),  # Only the first trace is visible
-                colorscale='Blues'  # Change color gradient to light blue to dark
-            )
-        )
+        # Only the first trace is visible
+        traces.append(create_trace(count_df, sponsor, visible=(sponsor == count_df['Sponsor'].unique()[0])))
     return traces
 
 def create_plot(dropdown, traces):
     """
     Create a base Choropleth map that will be updated based on the dropdown selection.
+    Without a dropdown the map only shows the given traces.
     """
     fig = go.Figure(data=traces)
+    fig.update_layout(title="Geographic Distribution of Competitor Trials")  # Add a title here
+    if not dropdown:
+        return fig
     fig.update_layout(
-        title="Geographic Distribution of Competitor Trials",  # Add a title here
         updatemenus=[
             go.layout.Updatemenu(
                 buttons=dropdown,
@@ -59,11 +64,21 @@ def create_plot(dropdown, traces):
     )
     return fig
 
-def main():
+def sponsors():
+    """
+    Return the sponsors that can be selected, in the order of the dropdown.
+    """
+    return list(prepare_data()['Sponsor'].unique())
+
+@instrument()
+def main(sponsor=None):
     """
     Main function to prepare data, create dropdown, create traces and create plot.
+    With a `sponsor` only the map of that sponsor is created, without the dropdown.
     """
     count_df = prepare_data()
+    if sponsor is not None:
+        return create_plot(None, [create_trace(count_df, sponsor)])
     dropdown = create_dropdown(count_df)
     traces = create_traces(count_df)
     fig = create_plot(dropdown, traces)  # Store the figure returned by create_plot
@@ -1,11 +1,12 @@
-from src.data_processing.utils import get_competitor_trials
+from src.data_processing.context import get_competitor_trials
 import plotly.graph_objects as go
+from src.instrumentation import instrument
 
 def prepare_data():
     """
     Prepare the data for plotting.
     """
-    intervention_df = get_competitor_trials()
+    intervention_df = get_competitor_trials(columns=["Interventions"])
     intervention_df["Intervention Type"] = intervention_df["Interventions"].str.split(":").str[0]
     value_counts = intervention_df[intervention_df["Intervention Type"] != '']["Intervention Type"].value_counts(dropna=True)
     labels = value_counts.index
@@ -19,6 +20,7 @@ def create_plot(labels, value_counts):
     fig.update_layout(title_text="Intervention Type of Competitor Trials")
     return fig  # Return the figure instead of showing it
 
+@instrument()
 def main():
     """
     Main function to prepare data and create plot.
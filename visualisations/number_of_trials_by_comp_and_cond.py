@@ -1,13 +1,13 @@
 import plotly.graph_objects as go
-from src.data_processing.utils import get_competitor_trials, get_competitor_trials_one_cond
+from src.data_processing.context import get_competitor_trials_one_cond
+from src.instrumentation import instrument
 
 def prepare_data():
     """
     Prepare the data for plotting.
     """
-    competitor_trials_df = get_competitor_trials()
     competitor_trials_one_cond = get_competitor_trials_one_cond()
-    pivot_table = competitor_trials_one_cond.pivot_table(index='Sponsor', columns='Group', aggfunc='size', fill_value=0)
+    pivot_table = competitor_trials_one_cond.pivot_table(index='Sponsor', columns='Group', aggfunc='size', fill_value=0, observed=True)
     pivot_table = pivot_table.reindex(pivot_table.sum(axis=1).sort_values(ascending=True).index)
     return pivot_table
 
@@ -32,6 +32,7 @@ def create_plot(traces):
     fig = go.Figure(data=traces, layout=layout)
     return fig
 
+@instrument()
 def main():
     """
     Main function to prepare data, create traces and create plot.
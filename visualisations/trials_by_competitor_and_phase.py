@@ -1,15 +1,16 @@
 import plotly.graph_objects as go
-from src.data_processing.utils import get_competitor_trials
+from src.data_processing.context import get_competitor_trials
+from src.instrumentation import instrument
 
 def prepare_data():
     """
     Prepare the data for plotting.
     """
-    competitor_trials_df = get_competitor_trials()
+    competitor_trials_df = get_competitor_trials(columns=['Sponsor', 'Phases'])
     competitor_trials_df['Phases'] = competitor_trials_df['Phases'].replace('', 'Not Reported')
     order = ['PHASE1', 'PHASE1|PHASE2', 'PHASE2', 'PHASE2|PHASE3', 'PHASE3', 'PHASE4', 'NA', 'Not Reported']
     order = ['PHASE1', 'PHASE1|PHASE2', 'PHASE2', 'PHASE2|PHASE3', 'PHASE3', 'PHASE4', 'NA', 'Not Reported']
-    pivot_table = competitor_trials_df.pivot_table(index='Sponsor', columns='Phases', aggfunc='size', fill_value=0)
+    pivot_table = competitor_trials_df.pivot_table(index='Sponsor', columns='Phases', aggfunc='size', fill_value=0, observed=True)
 
     # Subset the DataFrame with only the elements of 'order' that are present in the DataFrame's columns
     order = [phase for phase in order if phase in pivot_table.columns]
@@ -39,6 +40,7 @@ def create_plot(traces):
     fig.update_layout(legend_traceorder="normal")
     return fig
 
+@instrument()
 def main():
     """
     Main function to prepare data, create traces and create plot.